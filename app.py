@@ -1,23 +1,32 @@
 import os
 import json
-import weaviate
-import pandas as pd
-from vanna.weaviate.weaviate_vector import WeaviateDatabase
-from vanna.base import VannaBase
 from dotenv import load_dotenv
-from langchain_openai import AzureChatOpenAI
-from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
-from contextlib import asynccontextmanager
+from contextlib import AsyncExitStack, asynccontextmanager
 from collections.abc import AsyncIterator
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING
+import functools
+import threading
 import time
-import openpyxl
-from openpyxl import load_workbook
 
 # Import MCP and anyio components
 from mcp.server.fastmcp import FastMCP, Context
 import anyio
 
+import metrics
+from caches import ContextSnapshot, DatabaseVersion, ResultCache, is_deterministic_sql, sql_fingerprint
+from query_log import QueryLogWriter, new_request_id
+from result_pages import CursorRegistry
+from sqlite_pool import QueryTimeout
+from tracing import configure as configure_tracing, current_span, record_exception, span, traced
+from warmup import parse_steps, run_warmup
+
+if TYPE_CHECKING:
+    from caches import ContextPayload
+    from starlette.requests import Request
+    from starlette.responses import Response
+    from vanna_engine import VannaPipeline
+
 # Import and configure the logging module
 import logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -40,65 +49,36 @@ signal.signal(signal.SIGTERM, shutdown_handler)
 # Load environment variables from .env file
 load_dotenv()
 
-class LangChainAzureChat(VannaBase):
-    def __init__(self, config=None):
-        super().__init__(config=config)
-        self.llm = AzureChatOpenAI(
-            azure_deployment="gpt-4.1",
-            api_version="2024-02-15-preview",
-            temperature=0.0,
-            max_tokens=1000,
-            api_key=os.getenv("OPENAI_API_KEY"),
-            azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
-        )
-
-    def system_message(self, message: str) -> SystemMessage:
-        return SystemMessage(content=message)
-
-    def user_message(self, message: str) -> HumanMessage:
-        return HumanMessage(content=message)
-
-    def assistant_message(self, message: str) -> AIMessage:
-        return AIMessage(content=message)
+# --- MCP Server Integration ---
 
-    def submit_prompt(self, prompt, **kwargs) -> str:
-        response = self.llm.invoke(prompt)
-        logging.info(f"Response: {response}")
-        input_tokens = response.usage_metadata.get('input_tokens')
-        output_tokens = response.usage_metadata.get('output_tokens')
-        return response.content, input_tokens, output_tokens
-        
-class MyVanna(WeaviateDatabase, LangChainAzureChat):
-    def __init__(self, config=None):
-        self.config = config or {}
-        WeaviateDatabase.__init__(self, config=config)
-        LangChainAzureChat.__init__(self, config=config)
-
-    def _initialize_weaviate_client(self):
-        if self.config.get("weaviate_api_key"):
-            return weaviate.connect_to_weaviate_cloud(
-                cluster_url=self.config["weaviate_url"],
-                auth_credentials=weaviate.auth.AuthApiKey(self.config["weaviate_api_key"]),
-                skip_init_checks=True
-            )
-        else:
-            raise ValueError("Weaviate API key is required for online Weaviate.")
+@dataclass
+class AppContext:
+    vn: "VannaPipeline"
+    query_log: QueryLogWriter
+    cursors: CursorRegistry
+    result_cache: ResultCache
+    database_version: DatabaseVersion
+    generate_limiter: "RequestLimiter | None" = None
+    execute_limiter: "RequestLimiter | None" = None
+    context_snapshot: ContextSnapshot = field(default_factory=ContextSnapshot)
 
-    def __enter__(self):
-        return self
 
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        self.weaviate_client.close()
-        logging.info("\nWeaviate connection closed successfully.")
+class RequestLimiter:
+    """
+    Lets at most `max_concurrency` HTTP gateway requests of one kind run at once
+    and queues up to `max_waiting` more. Past that, requests are turned away with
+    503 rather than piling up behind the LLM or SQLite.
+    """
+    def __init__(self, max_concurrency: int, max_waiting: int):
+        self.limiter = anyio.CapacityLimiter(max_concurrency)
+        self.max_waiting = max_waiting
 
-# --- MCP Server Integration ---
+    def full(self) -> bool:
+        return self.limiter.statistics().tasks_waiting >= self.max_waiting
 
-@dataclass
-class AppContext:
-    vn: MyVanna
 
 @asynccontextmanager
-async def app_lifespan(server: FastMCP) -> AsyncIterator[AppContext]:
+async def build_app_context() -> AsyncIterator[AppContext]:
     """
     Manages the Vanna AI instance's lifecycle.
     """
@@ -106,128 +86,708 @@ async def app_lifespan(server: FastMCP) -> AsyncIterator[AppContext]:
     config = {
         "weaviate_url": os.getenv("WEAVIATE_URL"),
         "weaviate_api_key": os.getenv("WEAVIATE_API_KEY"),
+        "vector_store": os.getenv("VECTOR_STORE", "weaviate"),
+        "local_vector_path": os.getenv("LOCAL_VECTOR_PATH", "vector_store.npz"),
+        "llm_max_concurrency": int(os.getenv("LLM_MAX_CONCURRENCY", "100")),
+        "llm_stream_usage": os.getenv("LLM_STREAM_USAGE", "0") == "1",
+        "sqlite_mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+        "sqlite_cache_size": int(os.getenv("SQLITE_CACHE_SIZE", str(-64 * 1024))),
+        "sqlite_temp_store": os.getenv("SQLITE_TEMP_STORE", "MEMORY"),
+        "sqlite_wal": os.getenv("SQLITE_WAL", "0") == "1",
+        "sql_timeout": float(os.getenv("SQL_TIMEOUT", "30")) or None,
+        "prompt_token_budget": int(os.getenv("PROMPT_TOKEN_BUDGET", "4000")),
+        "ddl_source": os.getenv("DDL_SOURCE", "schema"),
+        # Three lookups for each request that can be preparing a prompt at once
+        # (one per anyio worker thread), so the shared pool never queues them.
+        "retrieval_workers": int(os.getenv(
+            "RETRIEVAL_WORKERS", str(3 * int(anyio.to_thread.current_default_thread_limiter().total_tokens))
+        )),
     }
     
-    with MyVanna(config=config) as vn:
+    database_path = os.getenv("SQLITE_PATH", "financial.sqlite")
+    warmup_steps = parse_steps(os.getenv("WARMUP_STEPS", "all"))
+    configure_tracing(os.getenv("TRACE_EXPORTER", "none"), os.getenv("TRACE_PATH", "traces.jsonl"))
+    if os.getenv("METRICS_ENABLED", "1") == "1":
+        metrics.enable()
+    warmup_tables = [table.strip() for table in os.getenv("WARMUP_TABLES", "").split(",") if table.strip()] or None
+    gateway_max_waiting = int(os.getenv("GATEWAY_MAX_QUEUE", "100"))
+
+    # Imported here rather than at the top so that importing app.py (hot reload,
+    # `mcp dev`) does not pay for weaviate, langchain and fastembed.
+    from vanna_engine import create_vanna
+
+    with create_vanna(config) as vn:
         logging.info("🔗 Connecting to SQLite database...")
-        vn.connect_to_sqlite("financial.sqlite")
+        vn.connect_to_sqlite_pool(database_path)
+        await run_warmup(vn, warmup_steps, tables=warmup_tables)
         # The server should not train on startup.
         # Run the `train.py` script once to populate your vector store.
+        query_log = QueryLogWriter(
+            path=os.getenv("QUERY_LOG_PATH", "query_log.jsonl"),
+            excel_path=os.getenv("QUERY_LOG_EXCEL_PATH", "query_log_export.xlsx"),
+            export_interval=float(os.getenv("QUERY_LOG_EXPORT_INTERVAL", "0")) or None,
+        ).start()
+        cursors = CursorRegistry(vn.sqlite_pool.connect, ttl=float(os.getenv("SQL_CURSOR_TTL", "300")))
+        result_cache = ResultCache(max_bytes=int(os.getenv("RESULT_CACHE_MAX_BYTES", str(64 * 1024 * 1024))))
+        unregister_gauges = metrics.register_app_gauges(vn, query_log=query_log, result_cache=result_cache)
+        context_snapshot = ContextSnapshot()
+        try:
+            await anyio.to_thread.run_sync(context_snapshot.refresh, vn.training_version.current(), vn.get_context)
+        except Exception as e:
+            logging.warning(f"Could not build the context snapshot at startup: {e}")
         logging.info("✅ Vanna AI is ready. Server is online.")
-        yield AppContext(vn=vn)
+        try:
+            yield AppContext(
+                vn=vn,
+                query_log=query_log,
+                cursors=cursors,
+                result_cache=result_cache,
+                database_version=DatabaseVersion(database_path),
+                generate_limiter=RequestLimiter(int(os.getenv("GATEWAY_GENERATE_CONCURRENCY", "32")), gateway_max_waiting),
+                execute_limiter=RequestLimiter(int(os.getenv("GATEWAY_EXECUTE_CONCURRENCY", "16")), gateway_max_waiting),
+                context_snapshot=context_snapshot,
+            )
+        finally:
+            unregister_gauges()
+            cursors.close_all()
+            query_log.close(export=os.getenv("QUERY_LOG_EXPORT_ON_CLOSE", "0") == "1")
         
     logging.info("🔌 MCP Server shutting down...")
 
+
+class SharedAppContext:
+    """
+    The process's single AppContext, shared by every MCP session and the HTTP
+    gateway. FastMCP runs the lifespan once per session over HTTP (once per
+    request when stateless), so each user takes a reference instead: the first
+    builds the engine, pools and caches, and the last one out tears them down.
+    """
+    def __init__(self, factory):
+        self.factory = factory
+        self.context = None
+        self._users = 0
+        self._stack = None
+        self._lock = None
+
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator[AppContext]:
+        if self._lock is None:
+            self._lock = anyio.Lock()
+        async with self._lock:
+            if self.context is None:
+                stack = AsyncExitStack()
+                self.context = await stack.enter_async_context(self.factory())
+                self._stack = stack
+            self._users += 1
+        try:
+            yield self.context
+        finally:
+            with anyio.CancelScope(shield=True):
+                async with self._lock:
+                    self._users -= 1
+                    if self._users == 0:
+                        stack, self._stack, self.context = self._stack, None, None
+                        await stack.aclose()
+
+
+shared_app_context = SharedAppContext(build_app_context)
+
+
+@asynccontextmanager
+async def app_lifespan(server: FastMCP) -> AsyncIterator[AppContext]:
+    async with shared_app_context.acquire() as app_context:
+        yield app_context
+
 mcp = FastMCP(
     name="VannaAIServer",
     instructions="A server that uses Vanna AI to answer questions about a financial database.",
     lifespan=app_lifespan
 )
 
-# Excel logging utility
-LOG_FILE = "query_log.xlsx"
-LOG_COLUMNS = [
-    "question", "prompt", "llm_input_tokens", "llm_output_tokens", "llm_cost", "sql_gen_time", "sql_query", "fetch_time", "fetch_result"
-]
-
-def append_log_to_excel(row_dict):
-    if not os.path.exists(LOG_FILE):
-        # Create new DataFrame and save
-        df = pd.DataFrame([row_dict], columns=LOG_COLUMNS)
-        df.to_excel(LOG_FILE, index=False)
-    else:
-        # Append to existing file
-        wb = load_workbook(LOG_FILE)
-        ws = wb.active
-        ws.append([row_dict.get(col, "") for col in LOG_COLUMNS])
-        wb.save(LOG_FILE)
-
 def calculate_cost(input_tokens, output_tokens):
     # Example cost calculation (adjust rates as needed)
     if input_tokens is None or output_tokens is None:
         return None
     return (input_tokens * 0.0000015 + output_tokens * 0.000006) * 0.000001
 
+def check_answer_cache(vn: "VannaPipeline", q: str):
+    """
+    Blocking first step of SQL generation: the exact and semantic answer caches.
+    Returns (log fields, embedding, training version); the log fields carry
+    "sql_query" on a cache hit. The embedding is None on an exact hit.
+    """
+    version = vn.training_version.current()
+    with span("answer_cache.exact"):
+        cached_sql = vn.answer_cache.get_exact(q, version=version)
+    if cached_sql is not None:
+        return {"sql_query": cached_sql, "answer_cache": "exact"}, None, version
+
+    embedding, embedding_cached, embedding_time = vn.lookup_embedding(q)
+    result = {
+        "embedding_time": embedding_time,
+        "embedding_cache": "hit" if embedding_cached else "miss",
+    }
+    with span("answer_cache.semantic"):
+        cached_sql, similarity = vn.answer_cache.get_similar(embedding, version=version, question=q)
+    if cached_sql is not None:
+        result.update({"sql_query": cached_sql, "answer_cache": f"semantic ({similarity:.3f})"})
+    else:
+        result["answer_cache"] = "miss"
+    return result, embedding, version
+
+def retrieval_log_fields(prepared: dict) -> dict:
+    """
+    Log fields for the retrieval and prompt stages of a prepare_sql_prompt or
+    generate_sql_with_prompt result.
+    """
+    timings = prepared["timings"]
+    return {
+        "context_tokens": json.dumps(prepared["context_tokens"]),
+        "retrieval_time": timings["retrieval"],
+        "sql_retrieval_time": timings["sql"],
+        "ddl_retrieval_time": timings["ddl"],
+        "doc_retrieval_time": timings["doc"],
+    }
+
+def record_llm_answer(vn: "VannaPipeline", q: str, result: dict, prompt, embedding, version,
+                      sql, input_tokens, output_tokens, llm_time):
+    """
+    Caches a freshly generated answer and adds the LLM fields to its log row.
+    """
+    if sql:
+        vn.answer_cache.put(q, embedding, sql, version=version)
+    cost = calculate_cost(input_tokens, output_tokens)
+    metrics.record_llm_usage(input_tokens, output_tokens, cost)
+    result.update({
+        "prompt": "\n".join([f"({msg.type}) {msg.content}" for msg in prompt]),
+        "llm_input_tokens": input_tokens,
+        "llm_output_tokens": output_tokens,
+        "llm_cost": cost,
+        "sql_gen_time": llm_time,
+        "sql_query": sql
+    })
+    return result
+
+async def generate_sql(app_context: AppContext, question: str, request_id: str) -> str:
+    """
+    Answers `question` with SQL (empty if none could be generated) and logs the
+    question, prompt, LLM tokens, cost, and timing to the query log under
+    `request_id`. Shared by the ask_sql tool and the HTTP gateway's /generate.
+    """
+    vn_instance = app_context.vn
+    query_log = app_context.query_log
+    logging.info(f"Received question for SQL generation: '{question}'")
+    log_row = {"request_id": request_id, "event": "ask", "question": question}
+    current_span().set_attribute("request_id", log_row["request_id"])
+
+    # The cache lookups run on a worker thread; generation then does retrieval
+    # once (also on a thread) and awaits the LLM call natively.
+    result, embedding, version = await anyio.to_thread.run_sync(check_answer_cache, vn_instance, question)
+    if "sql_query" not in result:
+        generation = await vn_instance.agenerate_sql_with_prompt(question, embedding=embedding)
+        result.update(retrieval_log_fields(generation))
+        result = record_llm_answer(vn_instance, question, result, generation["prompt"], embedding, version,
+                                   generation["llm_response"], generation["input_tokens"],
+                                   generation["output_tokens"], generation["timings"]["llm"])
+    sql_query = result["sql_query"]
+    logging.info(f"Generated SQL (answer cache: {result['answer_cache']}): {sql_query}")
+    current_span().set_attribute("answer_cache", result["answer_cache"])
+    with span("query_log"):
+        log_row.update(result)
+        query_log.log(log_row)
+        query_log.remember_sql(sql_query, log_row["request_id"])
+    return sql_query
+
+
+async def announce_request_id(ctx: Context, request_id: str) -> None:
+    """
+    Sends the request ID to the client as a debug log message from the
+    "request_id" logger, so a client can pass it to run_sql without the tool's
+    result (the SQL) changing.
+    """
+    logging.info(f"Request ID for {ctx.request_context.request_id}: {request_id}")
+    try:
+        await ctx.debug(request_id, logger_name="request_id")
+    except Exception as e:
+        logging.debug(f"Could not send the request ID to the client: {e}")
+
+
 # **FIX: This is the corrected ask_sql tool**
 @mcp.tool()
+@traced("ask_sql")
 async def ask_sql(question: str, ctx: Context) -> str:
     """
     Takes a natural language question about financial data and returns a SQL query.
-    Logs question, prompt, LLM tokens, cost, and timing to Excel.
+    Logs question, prompt, LLM tokens, cost, and timing to the query log. The
+    request's ID is sent as a debug log message (logger "request_id"); passing it
+    to run_sql logs the query's results under this request.
+    """
+    request_id = new_request_id()
+    await announce_request_id(ctx, request_id)
+    try:
+        sql_query = await generate_sql(ctx.request_context.lifespan_context, question, request_id)
+        return sql_query or "Could not generate a valid SQL query."
+    except Exception as e:
+        logging.error(f"Error in ask_sql tool: {e}", exc_info=True)
+        record_exception(e)
+        return f"Error generating SQL query: {e}"
+
+
+@mcp.tool()
+@traced("ask_sql_stream")
+async def ask_sql_stream(question: str, ctx: Context) -> str:
+    """
+    Streaming variant of ask_sql. The SQL is sent to the client piece by piece as it
+    is generated (as progress notifications when the client passed a progress token,
+    otherwise as log messages) and the complete query is returned at the end.
+    Logs the same fields as ask_sql plus the time to the first streamed token, and
+    sends the request ID the same way.
     """
+    request_id = new_request_id()
+    await announce_request_id(ctx, request_id)
     try:
         vn_instance = ctx.request_context.lifespan_context.vn
-        logging.info(f"Received question for SQL generation: '{question}'")
-        log_row = {"question": question}
-
-        def generate_sql_with_full_context(vn: MyVanna, q: str):
-            question_sql_list = vn.get_similar_question_sql(q)
-            prompt = vn.get_sql_prompt(
-                initial_prompt=vn.config.get("initial_prompt", None) if hasattr(vn, "config") else None,
-                question=q,
-                question_sql_list=question_sql_list,
-                ddl_list=vn.get_related_ddl(q),
-                doc_list=vn.get_related_documentation(q)
+        query_log = ctx.request_context.lifespan_context.query_log
+        logging.info(f"Received question for streaming SQL generation: '{question}'")
+        log_row = {"request_id": request_id, "event": "ask", "question": question}
+        current_span().set_attribute("request_id", log_row["request_id"])
+        meta = ctx.request_context.meta
+        has_progress_token = meta is not None and meta.progressToken is not None
+
+        async def send_partial(partial_sql: str, delta: str):
+            if has_progress_token:
+                await ctx.report_progress(progress=len(partial_sql), message=partial_sql)
+            elif delta:
+                await ctx.info(delta)
+
+        result, embedding, version = await anyio.to_thread.run_sync(check_answer_cache, vn_instance, question)
+        if "sql_query" in result:
+            await send_partial(result["sql_query"] or "", result["sql_query"] or "")
+        else:
+            prepared = await anyio.to_thread.run_sync(
+                functools.partial(vn_instance.prepare_sql_prompt, question, embedding=embedding)
             )
-            logging.info(f"Prompt: {prompt}")
+            result.update(retrieval_log_fields(prepared))
+            prompt = prepared["prompt"]
+            update_interval = vn_instance.config.get("stream_update_interval", 0.05)
             llm_start = time.time()
-            sql, input_tokens, output_tokens = vn.submit_prompt(prompt)
-            llm_cost = calculate_cost(input_tokens, output_tokens)
-            llm_time = time.time() - llm_start
-            return sql, prompt, input_tokens, output_tokens, llm_cost, llm_time
-
-        sql_query, prompt, input_tokens, output_tokens, llm_cost, llm_time = await anyio.to_thread.run_sync(
-            generate_sql_with_full_context, vn_instance, question
-        )
-        logging.info(f"Generated SQL: {sql_query}")
-        prompt_str = "\n".join([f"({msg.type}) {msg.content}" for msg in prompt])
-        log_row.update({
-            "prompt": prompt_str,
-            "llm_input_tokens": input_tokens,
-            "llm_output_tokens": output_tokens,
-            "llm_cost": llm_cost,
-            "sql_gen_time": llm_time,
-            "sql_query": sql_query
-        })
-        append_log_to_excel(log_row)
+            first_token_time = None
+            last_update, sent_length = 0.0, 0
+            sql = ""
+            usage = {}
+            with span("llm.stream") as stream_span:
+                async for chunk in vn_instance.astream_prompt(prompt):
+                    if chunk.usage_metadata:
+                        usage = chunk.usage_metadata
+                    if not chunk.content:
+                        continue
+                    sql += chunk.content
+                    now = time.time()
+                    if first_token_time is None:
+                        first_token_time = now - llm_start
+                    # Always forward the first token; after that, batch updates so a
+                    # fast stream does not turn into one notification per token.
+                    if sent_length == 0 or now - last_update >= update_interval:
+                        await send_partial(sql, sql[sent_length:])
+                        last_update, sent_length = now, len(sql)
+                stream_span.set_attribute("llm.first_token_seconds", first_token_time or 0.0)
+            await send_partial(sql, sql[sent_length:])
+            result = record_llm_answer(vn_instance, question, result, prompt, embedding, version,
+                                       sql, usage.get("input_tokens"), usage.get("output_tokens"),
+                                       time.time() - llm_start)
+            result["llm_first_token_time"] = first_token_time
+        sql_query = result["sql_query"]
+        logging.info(f"Streamed SQL (answer cache: {result['answer_cache']}): {sql_query}")
+        current_span().set_attribute("answer_cache", result["answer_cache"])
+        with span("query_log"):
+            log_row.update(result)
+            query_log.log(log_row)
+            query_log.remember_sql(sql_query, log_row["request_id"])
         return sql_query or "Could not generate a valid SQL query."
     except Exception as e:
-        logging.error(f"Error in ask_sql tool: {e}", exc_info=True)
+        logging.error(f"Error in ask_sql_stream tool: {e}", exc_info=True)
+        record_exception(e)
         return f"Error generating SQL query: {e}"
 
 
+async def run_sql_cancellable(func, *args, timeout=None):
+    """
+    Runs a blocking SQLite call on a worker thread with a time budget. If the MCP
+    request is cancelled (or the client disconnects) while it runs, the query is
+    interrupted through its cancel event so the thread is freed right away.
+    """
+    cancel_event = threading.Event()
+    call = functools.partial(func, *args, timeout=timeout, cancel_event=cancel_event)
+    try:
+        return await anyio.to_thread.run_sync(call, abandon_on_cancel=True)
+    except anyio.get_cancelled_exc_class():
+        cancel_event.set()
+        raise
+
+
+def fetch_request_id(query_log: QueryLogWriter, sql_query: str, request_id: str | None) -> str:
+    """
+    The request a fetch is logged under: `request_id` as passed by the client,
+    else the ask request that generated this exact SQL text, else a new one.
+    """
+    if request_id:
+        return request_id
+    request_id = query_log.request_id_for_sql(sql_query)
+    if request_id:
+        logging.info(f"No request_id given for the query; matched ask request {request_id} by its SQL text")
+        return request_id
+    return new_request_id()
+
+
+async def execute_sql(app_context: AppContext, sql_query: str, request_id: str | None = None,
+                      page_size: int | None = None) -> str:
+    """
+    Runs `sql_query` for the run_sql tool and the HTTP gateway's /execute and
+    returns the result as a JSON string (see run_sql), logging fetch time and
+    result to the query log. A timed out or cancelled query is logged and its
+    QueryTimeout re-raised.
+    """
+    vn_instance = app_context.vn
+    query_log = app_context.query_log
+    logging.info(f"Executing SQL query: {sql_query}")
+    request_id = fetch_request_id(query_log, sql_query, request_id)
+    current_span().set_attribute("request_id", request_id)
+    fetch_start = time.time()
+    cache_fields = {}
+    timeout = vn_instance.config.get("sql_timeout")
+    try:
+        if page_size:
+            with span("sqlite.page", page_size=page_size):
+                page = await run_sql_cancellable(app_context.cursors.open, sql_query, page_size, timeout=timeout)
+            with span("serialize"):
+                fetch_result = json.dumps(page, default=str)
+        else:
+            # Queries using random(), CURRENT_TIMESTAMP, date('now') and the like
+            # would be frozen at their first result, so they always run.
+            fingerprint, fetch_result = None, None
+            if is_deterministic_sql(sql_query):
+                with span("result_cache"):
+                    fingerprint = sql_fingerprint(sql_query)
+                    version = app_context.database_version.current()
+                    fetch_result = app_context.result_cache.get(fingerprint, version=version)
+            if fetch_result is not None:
+                cache_fields = {"result_cache": "hit", "bytes_saved": len(fetch_result)}
+            else:
+                df = await run_sql_cancellable(vn_instance.run_sql, sql_query, timeout=timeout)
+                if df is not None:
+                    with span("serialize") as serialize_span:
+                        fetch_result = df.to_json(orient='records')
+                        serialize_span.set_attribute("serialize.bytes", len(fetch_result))
+                    if fingerprint is not None:
+                        app_context.result_cache.put(fingerprint, fetch_result, cost=time.time() - fetch_start,
+                                                     version=version)
+                else:
+                    fetch_result = "Query executed, but no results were returned."
+                cache_fields = {"result_cache": "miss" if fingerprint is not None else "bypassed", "bytes_saved": 0}
+    except QueryTimeout as e:
+        query_log.log({
+            "request_id": request_id,
+            "event": "fetch",
+            "sql_query": sql_query,
+            "fetch_time": e.elapsed,
+            "fetch_result": json.dumps(e.to_dict()),
+        })
+        raise
+    fetch_time = time.time() - fetch_start
+    logging.info(f"Fetched SQL result in {fetch_time:.3f}s (result cache: {cache_fields.get('result_cache', 'bypassed')})")
+    current_span().set_attribute("result_cache", cache_fields.get("result_cache", "bypassed"))
+    with span("query_log"):
+        query_log.log({
+            "request_id": request_id,
+            "event": "fetch",
+            "sql_query": sql_query,
+            "fetch_time": fetch_time,
+            "fetch_result": fetch_result,
+            **cache_fields,
+        })
+    return fetch_result
+
+
 @mcp.tool()
-async def run_sql(sql_query: str, ctx: Context) -> str:
+@traced("run_sql")
+async def run_sql(sql_query: str, ctx: Context, request_id: str | None = None, page_size: int | None = None) -> str:
     """
     Executes a SQL query against the financial database and returns the result as a JSON string.
-    Logs fetch time and result to Excel.
+    Identical queries (after normalizing whitespace and comments) are served from a
+    result cache until the database file changes, except those using random(),
+    CURRENT_TIMESTAMP, 'now' and similar. With `page_size`, returns only the
+    first page as {"columns", "rows", "row_offset", "next_token"}; pass `next_token`
+    to fetch_sql_page for the following pages.
+    Queries running longer than the configured budget (SQL_TIMEOUT) or whose request
+    is cancelled are aborted and return {"error", "elapsed", "timeout",
+    "rows_returned", "vm_steps"}.
+    Logs fetch time and result to the query log under `request_id`, the ID
+    ask_sql sent with the query. Without it, the ask request is looked up by the
+    query's SQL text.
     """
     try:
-        vn_instance = ctx.request_context.lifespan_context.vn
-        logging.info(f"Executing SQL query: {sql_query}")
-        fetch_start = time.time()
-        df = await anyio.to_thread.run_sync(vn_instance.run_sql, sql_query)
-        fetch_time = time.time() - fetch_start
-        if df is not None:
-            fetch_result = df.to_json(orient='records')
-        else:
-            fetch_result = "Query executed, but no results were returned."
-        # Try to append to the last row in Excel (if possible)
-        try:
-            if os.path.exists(LOG_FILE):
-                wb = load_workbook(LOG_FILE)
-                ws = wb.active
-                last_row = ws.max_row
-                ws.cell(row=last_row, column=LOG_COLUMNS.index("fetch_time")+1, value=fetch_time)
-                ws.cell(row=last_row, column=LOG_COLUMNS.index("fetch_result")+1, value=fetch_result)
-                wb.save(LOG_FILE)
-        except Exception as e:
-            logging.error(f"Error updating fetch log in Excel: {e}")
-        return fetch_result
+        return await execute_sql(ctx.request_context.lifespan_context, sql_query, request_id=request_id,
+                                 page_size=page_size)
+    except QueryTimeout as e:
+        logging.warning(f"run_sql aborted: {e}")
+        record_exception(e)
+        return json.dumps(e.to_dict())
     except Exception as e:
         logging.error(f"Error in run_sql tool: {e}", exc_info=True)
+        record_exception(e)
         return f"Error executing SQL query: {e}"
 
+
+@mcp.tool()
+@traced("fetch_sql_page")
+async def fetch_sql_page(next_token: str, ctx: Context) -> str:
+    """
+    Returns the next page of a paginated run_sql result as a JSON string with the
+    same shape as the first page. `next_token` is null on the last page.
+    """
+    try:
+        app_context = ctx.request_context.lifespan_context
+        page = await run_sql_cancellable(
+            app_context.cursors.fetch, next_token, timeout=app_context.vn.config.get("sql_timeout")
+        )
+        return json.dumps(page, default=str)
+    except QueryTimeout as e:
+        logging.warning(f"fetch_sql_page aborted: {e}")
+        record_exception(e)
+        return json.dumps(e.to_dict())
+    except Exception as e:
+        logging.error(f"Error in fetch_sql_page tool: {e}", exc_info=True)
+        record_exception(e)
+        return f"Error fetching SQL result page: {e}"
+
+
+@mcp.tool()
+async def export_query_log(ctx: Context) -> str:
+    """
+    Writes everything logged so far to the Excel query log and returns its path.
+    """
+    query_log = ctx.request_context.lifespan_context.query_log
+    future = query_log.request_export()
+    return await anyio.to_thread.run_sync(future.result)
+
+
+@mcp.tool()
+async def cache_stats(ctx: Context) -> str:
+    """
+    Returns hit/miss counters and sizes of the server's in-memory caches as a JSON string.
+    """
+    app_context = ctx.request_context.lifespan_context
+    return json.dumps({
+        "embedding_cache": app_context.vn.embedding_cache.stats(),
+        "answer_cache": app_context.vn.answer_cache.stats(),
+        "result_cache": app_context.result_cache.stats(),
+    })
+
+
+@mcp.tool(name="metrics")
+async def metrics_tool() -> str:
+    """
+    Returns the server's metrics (tool and stage latency histograms, LLM token and
+    cost counters, errors, queue depths, cache hit ratios) in the Prometheus text format.
+    """
+    return metrics.render()
+
+
+@mcp.resource("metrics://prometheus", name="metrics", mime_type="text/plain")
+def metrics_resource() -> str:
+    """
+    The server's metrics in the Prometheus text format.
+    """
+    return metrics.render()
+
+
+@mcp.custom_route("/metrics", methods=["GET"])
+async def metrics_endpoint(request: "Request") -> "Response":
+    """
+    Prometheus scrape endpoint, served next to the MCP endpoint by the HTTP transports.
+    """
+    from starlette.responses import PlainTextResponse
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+# --- HTTP gateway ---
+# /context, /generate and /execute for streamlit_app.py, served by the same process
+# and on the same engine, pools and caches as the MCP HTTP transports.
+
+async def read_json_field(request: "Request", field: str):
+    """
+    Returns the non-empty string `field` of the request's JSON body, or None.
+    """
+    try:
+        body = await request.json()
+    except ValueError:
+        return None
+    value = body.get(field) if isinstance(body, dict) else None
+    return value if isinstance(value, str) and value.strip() else None
+
+
+def accepts_gzip(accept_encoding: str) -> bool:
+    """
+    Whether an Accept-Encoding header allows gzip: listed (or covered by "*")
+    with a q-value above 0.
+    """
+    qualities = {}
+    for item in accept_encoding.split(","):
+        coding, *params = [part.strip() for part in item.split(";")]
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if coding:
+            qualities[coding.lower()] = quality
+    quality = qualities.get("gzip", qualities.get("x-gzip", qualities.get("*", 0.0)))
+    return quality > 0
+
+
+def overloaded_response() -> "Response":
+    from starlette.responses import JSONResponse
+    return JSONResponse({"error": "Server busy, retry shortly."}, status_code=503, headers={"Retry-After": "1"})
+
+
+async def current_context(app_context: AppContext) -> "ContextPayload":
+    """
+    The context snapshot for the current training version. It is built at startup;
+    after training changes the version, the first fetch rebuilds it.
+    """
+    version = app_context.vn.training_version.current()
+    payload = app_context.context_snapshot.get(version)
+    if payload is None:
+        payload = await anyio.to_thread.run_sync(app_context.context_snapshot.refresh, version,
+                                                 app_context.vn.get_context)
+    return payload
+
+
+@mcp.custom_route("/context", methods=["GET"])
+@traced("http.context")
+async def http_context(request: "Request") -> "Response":
+    """
+    The full schema DDL and documentation: {"schema": [...], "documentation": [...]}.
+    Served from the precomputed snapshot, gzipped when the client accepts it, with
+    a strong ETag; a matching If-None-Match gets 304 Not Modified.
+    """
+    from starlette.responses import JSONResponse, Response
+    try:
+        async with shared_app_context.acquire() as app_context:
+            payload = await current_context(app_context)
+        headers = {"ETag": payload.etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+        if payload.matches(request.headers.get("if-none-match")):
+            current_span().set_attribute("http.status_code", 304)
+            return Response(status_code=304, headers=headers)
+        if accepts_gzip(request.headers.get("accept-encoding", "")):
+            headers["Content-Encoding"] = "gzip"
+            return Response(payload.gzip_body, media_type="application/json", headers=headers)
+        return Response(payload.body, media_type="application/json", headers=headers)
+    except Exception as e:
+        logging.error(f"Error in /context: {e}", exc_info=True)
+        record_exception(e)
+        return JSONResponse({"error": f"Error fetching context: {e}"}, status_code=500)
+
+
+@mcp.resource("context://schema", name="context", mime_type="application/json")
+async def context_resource() -> str:
+    """
+    The full schema DDL and documentation as JSON, stamped with a "version" that
+    changes only when the content does (the hash behind the /context ETag).
+    """
+    async with shared_app_context.acquire() as app_context:
+        payload = await current_context(app_context)
+    return payload.resource_text
+
+
+@mcp.custom_route("/generate", methods=["POST"])
+@traced("http.generate")
+async def http_generate(request: "Request") -> "Response":
+    """
+    Takes {"question"} and returns {"question", "request_id", "sql"} (or
+    {"question", "request_id", "error"}), exactly as ask_sql would answer it.
+    """
+    from starlette.responses import JSONResponse
+    question = await read_json_field(request, "question")
+    if question is None:
+        return JSONResponse({"error": "Expected a JSON body with a non-empty 'question'."}, status_code=400)
+    request_id = new_request_id()
+    try:
+        async with shared_app_context.acquire() as app_context:
+            if app_context.generate_limiter.full():
+                return overloaded_response()
+            async with app_context.generate_limiter.limiter:
+                sql_query = await generate_sql(app_context, question, request_id)
+        if not sql_query:
+            return JSONResponse({"question": question, "request_id": request_id,
+                                 "error": "Could not generate a valid SQL query."})
+        return JSONResponse({"question": question, "request_id": request_id, "sql": sql_query})
+    except Exception as e:
+        logging.error(f"Error in /generate: {e}", exc_info=True)
+        record_exception(e)
+        return JSONResponse({"question": question, "request_id": request_id,
+                             "error": f"Error generating SQL query: {e}"}, status_code=500)
+
+
+@mcp.custom_route("/execute", methods=["POST"])
+@traced("http.execute")
+async def http_execute(request: "Request") -> "Response":
+    """
+    Takes {"sql"} and an optional "request_id" from /generate and returns
+    {"sql", "result"}, with the rows as run_sql returns them. Timed out queries
+    get 504 and the run_sql timeout fields.
+    """
+    from starlette.responses import JSONResponse, Response
+    sql_query = await read_json_field(request, "sql")
+    if sql_query is None:
+        return JSONResponse({"error": "Expected a JSON body with a non-empty 'sql'."}, status_code=400)
+    request_id = await read_json_field(request, "request_id")
+    try:
+        async with shared_app_context.acquire() as app_context:
+            if app_context.execute_limiter.full():
+                return overloaded_response()
+            async with app_context.execute_limiter.limiter:
+                fetch_result = await execute_sql(app_context, sql_query, request_id=request_id)
+    except QueryTimeout as e:
+        logging.warning(f"/execute aborted: {e}")
+        record_exception(e)
+        return JSONResponse({"sql": sql_query, **e.to_dict()}, status_code=504)
+    except Exception as e:
+        logging.error(f"Error in /execute: {e}", exc_info=True)
+        record_exception(e)
+        return JSONResponse({"sql": sql_query, "error": f"Error executing SQL query: {e}"}, status_code=400)
+    # fetch_result is already JSON (except for the no-rows message); splice it in
+    # rather than parsing and re-serializing a potentially large result.
+    result = fetch_result if fetch_result.startswith(("[", "{")) else json.dumps(fetch_result)
+    return Response(f'{{"sql": {json.dumps(sql_query)}, "result": {result}}}', media_type="application/json")
+
+
+def http_app(transport: str = "streamable-http"):
+    """
+    The ASGI app for the HTTP transports: the MCP endpoint, /metrics and the
+    gateway routes. It holds a reference to the shared AppContext for as long as
+    it runs, so the engine is warmed once at startup rather than per session.
+    """
+    starlette_app = mcp.streamable_http_app() if transport == "streamable-http" else mcp.sse_app()
+    transport_lifespan = starlette_app.router.lifespan_context
+
+    @asynccontextmanager
+    async def lifespan(app):
+        async with shared_app_context.acquire(), transport_lifespan(app):
+            yield
+
+    starlette_app.router.lifespan_context = lifespan
+    return starlette_app
+
+
 if __name__ == '__main__':
-    logging.info("Starting Vanna AI MCP Server...")
-    mcp.run()
\ No newline at end of file
+    transport = os.getenv("MCP_TRANSPORT", "stdio")
+    logging.info(f"Starting Vanna AI MCP Server ({transport})...")
+    if transport == "stdio":
+        mcp.run()
+    else:
+        import uvicorn
+        uvicorn.run(http_app(transport), host=mcp.settings.host, port=mcp.settings.port,
+                    log_level=mcp.settings.log_level.lower())
\ No newline at end of file
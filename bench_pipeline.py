@@ -0,0 +1,355 @@
+"""
+Latency benchmark for the ask_sql / run_sql hot paths.
+
+Drives the MCP tool functions in-process, the way the server calls them, against
+the real SQLite database. Azure OpenAI is replaced by a deterministic fake chat
+model with a configurable latency and token counts, and fastembed by a hashed
+bag-of-words embedding in the local vector store, so runs are repeatable and
+need no network. Questions are drawn from the training data in train_vanna.py
+with a configurable simple/moderate/hard mix.
+
+For each concurrency level, that many clients each send ask_sql followed by
+run_sql until the requests for the level are used up. The report gives p50/p95/p99
+latency, throughput and peak RSS per level as JSON. Pass --compare with an
+earlier report to print the change per level.
+
+The answer and result caches are off by default so every request takes the full
+path; --caches turns them on.
+
+Usage:
+    python bench_pipeline.py [--concurrency 1,4,16] [--requests 200] [--llm-latency 0.5]
+                             [--mix simple=0.5,moderate=0.3,hard=0.2] [--output bench_pipeline.json]
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import platform
+import random
+import re
+import resource
+import sys
+import tempfile
+import time
+import types
+
+import numpy as np
+from langchain_core.messages import AIMessage
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+EMBEDDING_DIM = 384
+
+
+class FakeChatModel:
+    """
+    Stands in for AzureChatOpenAI. Answers each question with its SQL from the
+    training data (or "SELECT 1;") after `latency` seconds, plus up to `jitter`
+    seconds drawn from a seeded generator, and reports fixed token counts.
+    """
+    def __init__(self, answers: dict, latency: float = 0.5, jitter: float = 0.0,
+                 input_tokens: int = 1500, output_tokens: int = 60, seed: int = 0):
+        self.answers = answers
+        self.latency = latency
+        self.jitter = jitter
+        self.input_tokens = input_tokens
+        self.output_tokens = output_tokens
+        self._random = random.Random(seed)
+
+    def _respond(self, prompt) -> AIMessage:
+        question = prompt[-1].content if isinstance(prompt, list) else str(prompt)
+        return AIMessage(
+            content=self.answers.get(question, "SELECT 1;"),
+            usage_metadata={"input_tokens": self.input_tokens, "output_tokens": self.output_tokens,
+                            "total_tokens": self.input_tokens + self.output_tokens},
+        )
+
+    def _delay(self) -> float:
+        return self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0.0)
+
+    def invoke(self, prompt, **kwargs) -> AIMessage:
+        time.sleep(self._delay())
+        return self._respond(prompt)
+
+    async def ainvoke(self, prompt, **kwargs) -> AIMessage:
+        await asyncio.sleep(self._delay())
+        return self._respond(prompt)
+
+
+class HashedEmbedding:
+    """
+    Stands in for fastembed's TextEmbedding: a signed feature-hashing bag of
+    words. Deterministic and cheap, and texts sharing words still land close
+    together, so retrieval returns sensible neighbours.
+    """
+    def __init__(self, dim: int = EMBEDDING_DIM):
+        self.dim = dim
+
+    def _embed_one(self, text: str):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for word in re.findall(r"\w+", text.lower()):
+            digest = hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest()
+            bucket = int.from_bytes(digest[:4], "little") % self.dim
+            vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+        return vector
+
+    def embed(self, documents, batch_size: int = 256, parallel=None):
+        if isinstance(documents, str):
+            documents = [documents]
+        for document in documents:
+            yield self._embed_one(document)
+
+
+def make_engine(config: dict, llm: FakeChatModel):
+    """
+    LocalVanna with the fake chat model and embedding plugged into its factory methods.
+    """
+    from vanna_engine import LocalVanna
+
+    class BenchVanna(LocalVanna):
+        def _create_llm(self):
+            return llm
+
+        def _create_embedding_model(self):
+            return HashedEmbedding()
+
+    return BenchVanna(config=config)
+
+
+def build_workload(tiers: dict, mix: dict, count: int, seed: int = 0) -> list:
+    """
+    Draws `count` (tier, question) pairs, picking tiers with the weights in `mix`.
+    """
+    rng = random.Random(seed)
+    names = [name for name in mix if tiers.get(name)]
+    weights = [mix[name] for name in names]
+    workload = []
+    for _ in range(count):
+        tier = rng.choices(names, weights=weights)[0]
+        workload.append((tier, rng.choice(tiers[tier])["question"]))
+    return workload
+
+
+def parse_mix(value: str) -> dict:
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        mix[name.strip()] = float(weight)
+    return mix
+
+
+def percentiles(values: list) -> dict:
+    if not values:
+        return {"p50": None, "p95": None, "p99": None, "mean": None, "max": None}
+    ordered = np.sort(np.asarray(values))
+    return {
+        "p50": float(np.percentile(ordered, 50)),
+        "p95": float(np.percentile(ordered, 95)),
+        "p99": float(np.percentile(ordered, 99)),
+        "mean": float(ordered.mean()),
+        "max": float(ordered[-1]),
+    }
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in KiB on Linux and bytes on macOS. It is the peak over the
+    # whole process, so it can only grow from one level to the next.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def make_context(app_context):
+    request_context = types.SimpleNamespace(lifespan_context=app_context, meta=None, request_id="bench")
+    return types.SimpleNamespace(request_context=request_context)
+
+
+async def run_level(app, app_context, workload: list, concurrency: int) -> dict:
+    """
+    Runs the workload with `concurrency` clients, each sending ask_sql then run_sql
+    for its next question. Returns the latency statistics for the level.
+    """
+    ctx = make_context(app_context)
+    queue = list(reversed(workload))
+    samples = []
+    errors = 0
+
+    async def client():
+        nonlocal errors
+        while queue:
+            tier, question = queue.pop()
+            start = time.perf_counter()
+            sql = await app.ask_sql(question, ctx)
+            asked = time.perf_counter()
+            result = await app.run_sql(sql, ctx)
+            done = time.perf_counter()
+            if sql.startswith("Error") or result.startswith("Error"):
+                errors += 1
+            samples.append((tier, asked - start, done - asked, done - start))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    seconds = time.perf_counter() - start
+    by_tier = {}
+    for tier, _, _, total in samples:
+        by_tier.setdefault(tier, []).append(total)
+    return {
+        "concurrency": concurrency,
+        "requests": len(samples),
+        "errors": errors,
+        "seconds": seconds,
+        "throughput_rps": len(samples) / seconds if seconds else None,
+        "ask_sql": percentiles([sample[1] for sample in samples]),
+        "run_sql": percentiles([sample[2] for sample in samples]),
+        "total": percentiles([sample[3] for sample in samples]),
+        "total_by_tier": {tier: percentiles(values) for tier, values in sorted(by_tier.items())},
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def reset_caches(vn, app_context) -> None:
+    from caches import ResultCache
+
+    vn.embedding_cache.clear()
+    vn.answer_cache.clear()
+    app_context.result_cache = ResultCache(max_bytes=app_context.result_cache.max_bytes)
+
+
+async def run_benchmark(args) -> dict:
+    import app
+    import train_vanna
+    from caches import DatabaseVersion, ResultCache
+    from query_log import QueryLogWriter
+    from result_pages import CursorRegistry
+
+    tiers = {
+        "simple": train_vanna.simple_training_data,
+        "moderate": train_vanna.moderate_training_data,
+        "hard": train_vanna.hard_training_data,
+    }
+    answers = {pair["question"]: pair["sql"] for pair in train_vanna.training_data}
+    llm = FakeChatModel(answers, latency=args.llm_latency, jitter=args.llm_jitter,
+                        input_tokens=args.input_tokens, output_tokens=args.output_tokens, seed=args.seed)
+
+    with tempfile.TemporaryDirectory(prefix="bench_pipeline_") as work_dir:
+        config = {
+            "vector_store": "local",
+            "local_vector_path": os.path.join(work_dir, "vector_store.npz"),
+            "local_vector_autosave": False,
+            "training_version_file": os.path.join(work_dir, ".training_version"),
+            "llm_max_concurrency": args.llm_max_concurrency,
+            "sql_timeout": 30.0,
+            "prompt_token_budget": args.prompt_token_budget,
+            "ddl_source": args.ddl_source,
+            "answer_cache_size": 512 if args.caches else 0,
+        }
+        with make_engine(config, llm) as vn:
+            vn.train_bulk(
+                ddl=[item["description"] for item in train_vanna.ddl_statements],
+                documentation=[item["description"] for item in train_vanna.documentation_entries],
+                question_sql=train_vanna.training_data,
+            )
+            vn.connect_to_sqlite_pool(args.db)
+            query_log = QueryLogWriter(
+                path=os.path.join(work_dir, "query_log.jsonl"), excel_path=os.path.join(work_dir, "query_log.xlsx"),
+            ).start()
+            cursors = CursorRegistry(vn.sqlite_pool.connect)
+            app_context = app.AppContext(
+                vn=vn,
+                query_log=query_log,
+                cursors=cursors,
+                result_cache=ResultCache(max_bytes=64 * 1024 * 1024 if args.caches else 0),
+                database_version=DatabaseVersion(args.db),
+            )
+            try:
+                if args.warmup:
+                    await run_level(app, app_context, build_workload(tiers, args.mix, args.warmup, seed=-1), 1)
+                levels = []
+                for concurrency in args.concurrency:
+                    reset_caches(vn, app_context)
+                    workload = build_workload(tiers, args.mix, args.requests, seed=args.seed)
+                    level = await run_level(app, app_context, workload, concurrency)
+                    levels.append(level)
+                    print(
+                        f"concurrency {concurrency:>4}: {level['throughput_rps']:8.2f} req/s, "
+                        f"total p50 {level['total']['p50'] * 1000:8.1f} ms, p95 {level['total']['p95'] * 1000:8.1f} ms, "
+                        f"p99 {level['total']['p99'] * 1000:8.1f} ms, peak RSS {level['peak_rss_mb']:.0f} MB"
+                        + (f", {level['errors']} errors" if level["errors"] else "")
+                    )
+            finally:
+                cursors.close_all()
+                query_log.close(export=False)
+
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": {
+            "requests": args.requests,
+            "mix": args.mix,
+            "llm_latency": args.llm_latency,
+            "llm_jitter": args.llm_jitter,
+            "input_tokens": args.input_tokens,
+            "output_tokens": args.output_tokens,
+            "caches": args.caches,
+            "ddl_source": args.ddl_source,
+            "seed": args.seed,
+        },
+        "levels": levels,
+    }
+
+
+def compare(report: dict, baseline: dict) -> None:
+    """
+    Prints the change in throughput and total p50/p95/p99 per concurrency level.
+    """
+    previous = {level["concurrency"]: level for level in baseline.get("levels", [])}
+    print("\nChange against baseline (negative latency is better):")
+    for level in report["levels"]:
+        before = previous.get(level["concurrency"])
+        if before is None:
+            continue
+        changes = [f"throughput {_change(level['throughput_rps'], before['throughput_rps'])}"]
+        for stat in ("p50", "p95", "p99"):
+            changes.append(f"{stat} {_change(level['total'][stat], before['total'][stat])}")
+        print(f"  concurrency {level['concurrency']:>4}: " + ", ".join(changes))
+
+
+def _change(value, before) -> str:
+    if not value or not before:
+        return "n/a"
+    return f"{(value - before) / before:+.1%}"
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default=os.getenv("SQLITE_PATH", "financial.sqlite"))
+    parser.add_argument("--concurrency", default="1,4,16,64",
+                        type=lambda value: [int(level) for level in value.split(",")])
+    parser.add_argument("--requests", type=int, default=200, help="requests per concurrency level")
+    parser.add_argument("--warmup", type=int, default=10, help="requests run once before measuring")
+    parser.add_argument("--mix", default="simple=0.5,moderate=0.3,hard=0.2", type=parse_mix)
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="seconds per fake LLM call")
+    parser.add_argument("--llm-jitter", type=float, default=0.0, help="extra random seconds per call, up to")
+    parser.add_argument("--llm-max-concurrency", type=int, default=100)
+    parser.add_argument("--input-tokens", type=int, default=1500)
+    parser.add_argument("--output-tokens", type=int, default=60)
+    parser.add_argument("--prompt-token-budget", type=int, default=4000)
+    parser.add_argument("--ddl-source", default="schema", choices=["schema", "vector"])
+    parser.add_argument("--caches", action="store_true", help="enable the answer and result caches")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="bench_pipeline.json")
+    parser.add_argument("--compare", default=None, help="earlier report to compare against")
+    parser.add_argument("--log-level", default="WARNING",
+                        help="per-request INFO logging is part of the server's cost but floods the console")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(args.log_level)
+    report = asyncio.run(run_benchmark(args))
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nReport saved to {args.output}")
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
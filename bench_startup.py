@@ -0,0 +1,96 @@
+"""
+Startup-time budget for the MCP server.
+
+Imports app.py in a fresh interpreter under `python -X importtime`, reports the
+cumulative import time and the heaviest imports, and exits with status 1 when the
+best of several runs exceeds the budget or when a dependency that should only be
+loaded lazily shows up at import time.
+
+Usage:
+    python bench_startup.py [--module app] [--budget-ms 1200] [--runs 3] [--top 15]
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+# Loaded inside app_lifespan or on first use, never by importing app.py.
+LAZY_MODULES = ["pandas", "openpyxl", "numpy", "weaviate", "langchain_openai", "langchain_core",
+                "fastembed", "vanna", "tiktoken", "tkinter", "flask"]
+
+
+def measure(module: str) -> list:
+    """
+    Imports `module` in a subprocess and returns the -X importtime rows as
+    (self_us, cumulative_us, depth, name), in the order they were printed.
+    """
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="1")
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, env=env, cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{proc.stderr[-2000:]}")
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((int(self_us), int(cumulative_us), depth, name.strip()))
+    return rows
+
+
+def module_rows(rows: list, module: str) -> list:
+    """
+    The rows of `module` and everything it imported. -X importtime prints a
+    module after its imports, so that is the module's own row and the rows
+    before it back to the previous top-level import (interpreter startup).
+    """
+    end = next(i for i, row in enumerate(rows) if row[2] == 0 and row[3] == module)
+    start = end
+    while start > 0 and rows[start - 1][2] > 0:
+        start -= 1
+    return rows[start:end + 1]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="app")
+    parser.add_argument("--budget-ms", type=float, default=float(os.getenv("STARTUP_BUDGET_MS", "1200")))
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    best_ms, best_rows = None, None
+    for _ in range(args.runs):
+        rows = module_rows(measure(args.module), args.module)
+        total_ms = rows[-1][1] / 1000
+        if best_ms is None or total_ms < best_ms:
+            best_ms, best_rows = total_ms, rows
+
+    print(f"import {args.module}: {best_ms:.1f} ms (best of {args.runs}), budget {args.budget_ms:.0f} ms")
+    top_level = {}
+    for _, cumulative_us, depth, name in best_rows:
+        root = name.split(".")[0]
+        if root != args.module:
+            top_level[root] = max(top_level.get(root, 0), cumulative_us)
+    print("Heaviest top-level packages:")
+    for root, cumulative_us in sorted(top_level.items(), key=lambda item: item[1], reverse=True)[:args.top]:
+        print(f"  {cumulative_us / 1000:8.1f} ms  {root}")
+
+    failed = False
+    eager = sorted({name.split(".")[0] for _, _, _, name in best_rows} & set(LAZY_MODULES))
+    if eager:
+        print(f"FAIL: imported eagerly, should be lazy: {', '.join(eager)}")
+        failed = True
+    if best_ms > args.budget_ms:
+        print(f"FAIL: import time {best_ms:.1f} ms exceeds the {args.budget_ms:.0f} ms budget")
+        failed = True
+    if not failed:
+        print("OK")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
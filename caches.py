@@ -0,0 +1,501 @@
+"""
+In-memory caches shared by the Vanna MCP server and its helper scripts.
+"""
+import hashlib
+import heapq
+import itertools
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+
+def normalize_question(question: str) -> str:
+    """
+    Case- and whitespace-insensitive key for a natural language question.
+    """
+    return " ".join(question.lower().split())
+
+
+# Parts of a question that pick out particular rows: quoted strings, numbers and
+# capitalized names. "loans above 100000" and "loans above 200000" embed almost
+# identically but need different SQL.
+_QUESTION_LITERAL = re.compile(r"'[^']*'|\"[^\"]*\"|\d+(?:[.,:/-]\d+)*|\b[A-Z][\w-]*")
+
+
+def question_literals(question: str) -> tuple:
+    """
+    The literal tokens of a question in order, leaving out its first word, which
+    is capitalized anyway.
+
+    >>> question_literals("How many clients in Prague have loans above 100000?")
+    ('Prague', '100000')
+    >>> question_literals("List accounts opened in 'East Bohemia' in 1995")
+    ("'East Bohemia'", '1995')
+    """
+    return tuple(match.group() for match in _QUESTION_LITERAL.finditer(question.strip()) if match.start() > 0
+                 or not match.group()[0].isalpha())
+
+
+class EmbeddingCache:
+    """
+    Bounded LRU cache of question embeddings keyed by normalized question text.
+    """
+    def __init__(self, max_size: int = 1024):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, question: str):
+        key = normalize_question(question)
+        with self._lock:
+            embedding = self._entries.get(key)
+            if embedding is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return embedding
+
+    def put(self, question: str, embedding) -> None:
+        if self.max_size <= 0:
+            return
+        key = normalize_question(question)
+        with self._lock:
+            self._entries[key] = embedding
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._entries),
+                "max_size": self.max_size,
+            }
+
+
+class TrainingVersion:
+    """
+    Version stamp of the vector store contents, shared with train_vanna.py through
+    a small file. Training bumps it; caches built on top of training data compare
+    it on lookup and drop their entries when it changes.
+    """
+    def __init__(self, path: str):
+        self.path = path
+
+    def current(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def bump(self) -> None:
+        with open(self.path, "w") as f:
+            f.write(str(time.time_ns()))
+
+
+class AnswerCache:
+    """
+    Two-layer cache of generated SQL answers.
+
+    The exact layer is keyed by normalized question text. The semantic layer
+    matches a question embedding against the embeddings of cached questions and
+    returns the closest answer whose cosine similarity reaches `similarity_threshold`
+    and whose question has the same literals (numbers, quoted strings and
+    capitalized names, see question_literals) as the one asked.
+    Entries are evicted least-recently-used once `max_size` is exceeded and expire
+    after `ttl` seconds. All entries are dropped when the training version changes.
+    """
+    def __init__(self, max_size: int = 512, ttl: float = 3600, similarity_threshold: float = 0.95):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.literal_mismatches = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()  # key -> (answer, unit vector, expires_at, literals)
+        self._matrix = None
+        self._matrix_keys = []
+        self._version = None
+        self._lock = threading.Lock()
+
+    def _check_version(self, version) -> None:
+        if version != self._version:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self._matrix = None
+            self._version = version
+
+    def _expire(self, now: float) -> None:
+        expired = [key for key, entry in self._entries.items() if entry[2] <= now]
+        for key in expired:
+            del self._entries[key]
+        if expired:
+            self._matrix = None
+
+    def get_exact(self, question: str, version=None):
+        """
+        Returns the cached answer for this exact (normalized) question, or None.
+        """
+        key = normalize_question(question)
+        now = time.monotonic()
+        with self._lock:
+            self._check_version(version)
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[2] <= now:
+                del self._entries[key]
+                self._matrix = None
+                return None
+            self._entries.move_to_end(key)
+            self.exact_hits += 1
+            return entry[0]
+
+    def get_similar(self, embedding, version=None, question: str = None):
+        """
+        Returns (answer, similarity) for the most similar cached question above the
+        threshold, or (None, best similarity seen). With `question`, only cached
+        questions with the same literals qualify.
+        """
+        query = _unit(embedding)
+        literals = question_literals(question) if question is not None else None
+        now = time.monotonic()
+        with self._lock:
+            self._check_version(version)
+            self._expire(now)
+            if not self._entries:
+                self.misses += 1
+                return None, None
+            if self._matrix is None:
+                import numpy as np
+                self._matrix_keys = list(self._entries.keys())
+                self._matrix = np.stack([self._entries[key][1] for key in self._matrix_keys])
+            scores = self._matrix @ query
+            best_similarity = float(scores.max())
+            for position in scores.argsort()[::-1]:
+                similarity = float(scores[position])
+                if similarity < self.similarity_threshold:
+                    break
+                key = self._matrix_keys[position]
+                if literals is not None and self._entries[key][3] != literals:
+                    continue
+                self._entries.move_to_end(key)
+                self.semantic_hits += 1
+                return self._entries[key][0], similarity
+            if best_similarity >= self.similarity_threshold:
+                self.literal_mismatches += 1
+            self.misses += 1
+            return None, best_similarity
+
+    def put(self, question: str, embedding, answer, version=None) -> None:
+        if self.max_size <= 0:
+            return
+        key = normalize_question(question)
+        with self._lock:
+            self._check_version(version)
+            self._entries[key] = (answer, _unit(embedding), time.monotonic() + self.ttl, question_literals(question))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+            self._matrix = None
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._matrix = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "exact_hits": self.exact_hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "literal_mismatches": self.literal_mismatches,
+                "invalidations": self.invalidations,
+                "size": len(self._entries),
+                "max_size": self.max_size,
+            }
+
+
+class DatabaseVersion:
+    """
+    Detects changes to a SQLite database by the mtime and size of its file and of
+    its WAL file, if any. Unlike PRAGMA data_version this is comparable across
+    connections, which matters when every worker thread has its own.
+    """
+    def __init__(self, database_path: str):
+        self.paths = [database_path, database_path + "-wal"]
+
+    def current(self):
+        version = []
+        for path in self.paths:
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                version.append(None)
+                continue
+            version.append((st.st_mtime_ns, st.st_size))
+        return tuple(version)
+
+
+_SQL_TOKEN = re.compile(
+    r"(?P<comment>--[^\n]*|/\*.*?\*/)"
+    r"|(?P<literal>'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|`(?:[^`]|``)*`|\[[^\]]*\])"
+    r"|(?P<space>\s+)"
+    r"|(?P<other>[^'\"`\[\s-]+|-)",
+    re.DOTALL,
+)
+
+
+def sql_fingerprint(sql: str) -> str:
+    """
+    Hash of a canonical form of `sql`: comments dropped, whitespace outside quoted
+    strings and identifiers collapsed (and removed around parentheses, commas and
+    semicolons) and trailing semicolons stripped. Quoted strings and identifiers
+    are kept byte for byte. Case is kept, since result column names are taken from
+    the query text.
+
+    >>> sql_fingerprint("SELECT  a ,b FROM t ;") == sql_fingerprint("SELECT a,b FROM t")
+    True
+    >>> sql_fingerprint("SELECT * FROM t WHERE a = 'x  y'") == sql_fingerprint("SELECT * FROM t WHERE a = 'x y'")
+    False
+    >>> sql_fingerprint("SELECT * FROM t WHERE a = 'x, y'") == sql_fingerprint("SELECT * FROM t WHERE a = 'x,y'")
+    False
+    """
+    # (is_literal, text) tokens, with runs of whitespace and comments as one " ".
+    tokens = []
+    for match in _SQL_TOKEN.finditer(sql):
+        kind = match.lastgroup
+        if kind in ("comment", "space"):
+            if tokens and tokens[-1] != (False, " "):
+                tokens.append((False, " "))
+        else:
+            tokens.append((kind == "literal", match.group()))
+    while tokens and not tokens[-1][0] and tokens[-1][1].rstrip(" ;") != tokens[-1][1]:
+        text = tokens[-1][1].rstrip(" ;")
+        if text:
+            tokens[-1] = (False, text)
+        else:
+            tokens.pop()
+    parts = []
+    for position, (is_literal, text) in enumerate(tokens):
+        if not is_literal and text == " ":
+            before = tokens[position - 1] if position else None
+            after = tokens[position + 1] if position + 1 < len(tokens) else None
+            if before is None or after is None:
+                continue
+            if (not before[0] and before[1][-1] in "(),;") or (not after[0] and after[1][0] in "(),;"):
+                continue
+        parts.append(text)
+    return hashlib.sha256("".join(parts).encode("utf-8")).hexdigest()
+
+
+# SQLite functions and keywords whose value changes between runs of the same
+# query, and the 'now' time value accepted by the date and time functions.
+_VOLATILE_SQL_WORDS = frozenset({
+    "random", "randomblob", "changes", "total_changes", "last_insert_rowid",
+    "current_timestamp", "current_date", "current_time",
+})
+_SQL_WORD = re.compile(r"\w+")
+
+
+def is_deterministic_sql(sql: str) -> bool:
+    """
+    False if `sql` calls something whose result varies between runs (random(),
+    CURRENT_TIMESTAMP, date('now'), ...), so its result must not be cached.
+
+    >>> is_deterministic_sql("SELECT * FROM loan WHERE date > '1997-01-01'")
+    True
+    >>> is_deterministic_sql("SELECT * FROM loan ORDER BY RANDOM() LIMIT 5")
+    False
+    >>> is_deterministic_sql("SELECT * FROM loan WHERE date > date('now', '-1 year')")
+    False
+    """
+    for match in _SQL_TOKEN.finditer(sql):
+        if match.lastgroup == "literal":
+            if match.group().lower() == "'now'":
+                return False
+        elif match.lastgroup == "other":
+            if any(word.lower() in _VOLATILE_SQL_WORDS for word in _SQL_WORD.findall(match.group())):
+                return False
+    return True
+
+
+class ResultCache:
+    """
+    Byte-bounded cache of serialized query results keyed by SQL fingerprint.
+
+    Eviction is GreedyDual-Size: an entry's priority is L + cost / size, where cost
+    is the seconds the query took and L is the priority of the last evicted entry.
+    Large results that were cheap to compute go first, and entries that stop being
+    used age out as L rises. Everything is dropped when the database version changes.
+    """
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, max_entry_bytes: int = 8 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.bytes_saved = 0
+        self.size_bytes = 0
+        self._entries = {}  # fingerprint -> [value, size, cost, priority, seq]
+        self._heap = []
+        self._inflation = 0.0
+        self._counter = itertools.count()
+        self._version = None
+        self._lock = threading.Lock()
+
+    def _check_version(self, version) -> None:
+        if version != self._version:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self._heap.clear()
+            self.size_bytes = 0
+            self._version = version
+
+    def _prioritize(self, fingerprint: str, entry: list) -> None:
+        entry[3] = self._inflation + entry[2] / max(entry[1], 1)
+        entry[4] = next(self._counter)
+        heapq.heappush(self._heap, (entry[3], entry[4], fingerprint))
+
+    def get(self, fingerprint: str, version=None):
+        with self._lock:
+            self._check_version(version)
+            entry = self._entries.get(fingerprint)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._prioritize(fingerprint, entry)
+            self.hits += 1
+            self.bytes_saved += entry[1]
+            return entry[0]
+
+    def put(self, fingerprint: str, value: str, cost: float, version=None) -> None:
+        size = len(value)
+        if size > self.max_entry_bytes or size > self.max_bytes:
+            return
+        with self._lock:
+            self._check_version(version)
+            old = self._entries.pop(fingerprint, None)
+            if old is not None:
+                self.size_bytes -= old[1]
+            entry = [value, size, cost, 0.0, 0]
+            self._entries[fingerprint] = entry
+            self.size_bytes += size
+            self._prioritize(fingerprint, entry)
+            while self.size_bytes > self.max_bytes and self._heap:
+                priority, seq, victim = heapq.heappop(self._heap)
+                current = self._entries.get(victim)
+                if current is None or current[4] != seq:
+                    continue  # stale heap item
+                del self._entries[victim]
+                self.size_bytes -= current[1]
+                self._inflation = priority
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else None,
+                "bytes_saved": self.bytes_saved,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "entries": len(self._entries),
+                "size_bytes": self.size_bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+
+class ContextPayload:
+    """
+    One serialized build of the context: the JSON body, its gzip encoding, a
+    strong ETag (a hash of the body, so equal content gets an equal tag, across
+    restarts too) and the text of the MCP resource, which carries the same hash
+    as its "version".
+    """
+    __slots__ = ("version", "body", "gzip_body", "etag", "resource_text")
+
+    def __init__(self, version, context: dict, compresslevel: int = 6):
+        import gzip
+        import json
+
+        body = json.dumps(context, ensure_ascii=False).encode("utf-8")
+        digest = hashlib.blake2b(body, digest_size=16).hexdigest()
+        self.version = version
+        self.body = body
+        self.gzip_body = gzip.compress(body, compresslevel=compresslevel, mtime=0)
+        self.etag = f'"{digest}"'
+        self.resource_text = json.dumps({"version": digest, **context}, ensure_ascii=False)
+
+    def matches(self, if_none_match: str) -> bool:
+        """
+        Whether an If-None-Match header value names this payload's ETag.
+        """
+        if not if_none_match:
+            return False
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        return "*" in tags or any(tag.removeprefix("W/") == self.etag for tag in tags)
+
+
+class ContextSnapshot:
+    """
+    The schema and documentation context, serialized once per training version.
+    `get(version)` returns the current ContextPayload, or None when there is none
+    for `version` yet; `refresh(version, build)` then calls `build()` for the
+    {"schema", "documentation"} dict and swaps in a new payload. Concurrent
+    refreshes wait for a single build.
+    """
+    def __init__(self, compresslevel: int = 6):
+        self.compresslevel = compresslevel
+        self.builds = 0
+        self._payload = None
+        self._lock = threading.Lock()
+
+    def get(self, version):
+        payload = self._payload
+        return payload if payload is not None and payload.version == version else None
+
+    def refresh(self, version, build) -> ContextPayload:
+        with self._lock:
+            payload = self.get(version)
+            if payload is not None:
+                return payload
+            started = time.perf_counter()
+            payload = ContextPayload(version, build(), compresslevel=self.compresslevel)
+            self._payload = payload
+            self.builds += 1
+        logging.info(
+            f"Context snapshot {payload.etag}: {len(payload.body)} bytes, {len(payload.gzip_body)} gzipped, "
+            f"built in {time.perf_counter() - started:.3f}s"
+        )
+        return payload
+
+
+def _unit(embedding):
+    import numpy as np
+
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
@@ -0,0 +1,246 @@
+"""
+Concurrent, resumable evaluation on the BIRD dev set.
+
+Questions from dev.json are answered by a pool of worker threads, so at most
+`concurrency` LLM calls are in flight. Every finished item is appended to a JSONL
+checkpoint right away. A restarted run skips the items already in the checkpoint,
+as long as the checkpoint was written for the same inputs: its first line records
+the dev file's hash, the database and the training version, and a checkpoint
+written for other inputs is started over. predict_dev.json is rewritten from the checkpoint every few items and at the end,
+in the usual `predictions[str(idx)]` layout.
+
+Usage:
+    python eval_runner.py [--dev dev.json] [--output predict_dev.json] [--concurrency 8] [--fresh]
+                          [--allow-llm-to-see-data]
+"""
+import argparse
+import hashlib
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from dotenv import load_dotenv
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+def format_prediction(sql_query: str, db_id: str) -> str:
+    return f"{sql_query}\t----- bird -----\t{db_id}"
+
+
+def checkpoint_inputs(dev_path: str, database_path: str, training_version, **settings) -> dict:
+    """
+    What a checkpoint's predictions depend on: the dev file's contents, the
+    database, the vector store's training version and any predictor settings.
+    """
+    with open(dev_path, "rb") as f:
+        dev_sha256 = hashlib.sha256(f.read()).hexdigest()
+    inputs = {
+        "dev_sha256": dev_sha256,
+        "database": os.path.abspath(database_path),
+        "training_version": training_version,
+        **settings,
+    }
+    # Round-trip so tuples compare equal to the lists read back from the file.
+    return json.loads(json.dumps(inputs, default=str))
+
+
+def load_checkpoint(path: str, inputs: dict = None) -> dict:
+    """
+    Returns the checkpointed records keyed by idx. A truncated last line (from a
+    crash mid-write) is ignored; that item is simply predicted again. When
+    `inputs` is given and the checkpoint's header differs (or it has none),
+    nothing is returned and the run starts over.
+    """
+    records = {}
+    if not os.path.exists(path):
+        return records
+    written_for = None
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                logging.warning(f"Skipping unreadable checkpoint line in {path}")
+                continue
+            if "inputs" in record:
+                written_for = record["inputs"]
+                continue
+            records[record["idx"]] = record
+    if inputs is not None and records and written_for != inputs:
+        logging.warning(f"{path} was written for other inputs ({written_for}); starting over")
+        return {}
+    return records
+
+
+def write_predictions(records: dict, output_path: str) -> None:
+    """
+    Writes predict_dev.json atomically, ordered by idx.
+    """
+    predictions = {
+        str(idx): format_prediction(records[idx]["sql_query"], records[idx]["db_id"]) for idx in sorted(records)
+    }
+    tmp_path = f"{output_path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(predictions, f, indent=2)
+    os.replace(tmp_path, output_path)
+
+
+def write_debug_excel(records: dict, excel_path: str) -> None:
+    import pandas as pd
+
+    columns = ["idx", "question", "db_id", "sql_prompt", "sql_query"]
+    pd.DataFrame([records[idx] for idx in sorted(records)], columns=columns).to_excel(excel_path, index=False)
+
+
+class Progress:
+    def __init__(self, total: int, already_done: int):
+        self.total = total
+        self.done = already_done
+        self.started_with = already_done
+        self.start = time.time()
+        self._lock = threading.Lock()
+
+    def advance(self) -> str:
+        with self._lock:
+            self.done += 1
+            elapsed = time.time() - self.start
+            rate = (self.done - self.started_with) / elapsed if elapsed else 0.0
+            remaining = self.total - self.done
+            eta = remaining / rate if rate else float("inf")
+            eta_text = time.strftime("%H:%M:%S", time.gmtime(eta)) if eta != float("inf") else "--:--:--"
+            return f"[{self.done}/{self.total}] {rate:.2f} items/sec, ETA {eta_text}"
+
+
+def run_eval(dev_data: list, predict, checkpoint_path: str = "predict_dev.checkpoint.jsonl",
+             output_path: str = "predict_dev.json", concurrency: int = 8, flush_every: int = 25,
+             inputs: dict = None, resume: bool = True) -> dict:
+    """
+    Predicts SQL for every dev item not yet in the checkpoint. `predict(question)`
+    returns (prompt, sql_query) and is called from `concurrency` worker threads;
+    an exception is recorded as "Error: ..." in both fields, as before.
+    The checkpoint is resumed only with `resume` and when it was written for the
+    same `inputs` (see checkpoint_inputs); otherwise it is rewritten from scratch.
+    Returns all records (checkpointed and new) keyed by idx.
+    """
+    records = load_checkpoint(checkpoint_path, inputs) if resume else {}
+    if not records:
+        with open(checkpoint_path, "w", encoding="utf-8") as checkpoint:
+            checkpoint.write(json.dumps({"inputs": inputs}) + "\n")
+    pending = [idx for idx in range(len(dev_data)) if idx not in records]
+    logging.info(f"{len(records)} of {len(dev_data)} items already checkpointed; {len(pending)} to go")
+    progress = Progress(len(dev_data), len(records))
+
+    def evaluate(idx: int) -> dict:
+        item = dev_data[idx]
+        question = item.get('question', '')
+        try:
+            prompt, sql_query = predict(question)
+        except Exception as e:
+            prompt = f"Error: {str(e)}"
+            sql_query = f"Error: {str(e)}"
+        return {
+            "idx": idx,
+            "question": question,
+            "db_id": item.get('db_id', ''),
+            "sql_prompt": str(prompt),
+            "sql_query": sql_query,
+        }
+
+    since_flush = 0
+
+    def record_result(checkpoint, future) -> None:
+        nonlocal since_flush
+        record = future.result()
+        checkpoint.write(json.dumps(record, ensure_ascii=False) + "\n")
+        checkpoint.flush()
+        records[record["idx"]] = record
+        since_flush += 1
+        if since_flush >= flush_every:
+            write_predictions(records, output_path)
+            since_flush = 0
+        logging.info(f"{progress.advance()} idx {record['idx']}")
+
+    # Only `concurrency` items are submitted at a time, so an interrupted run
+    # stops after the calls in flight instead of working through a queue of
+    # every pending item whose results would then be thrown away.
+    queue = iter(pending)
+    in_flight = set()
+    pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="eval")
+    with open(checkpoint_path, "a", encoding="utf-8") as checkpoint:
+        try:
+            for idx in itertools.islice(queue, concurrency):
+                in_flight.add(pool.submit(evaluate, idx))
+            while in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    in_flight.discard(future)
+                    record_result(checkpoint, future)
+                    next_idx = next(queue, None)
+                    if next_idx is not None:
+                        in_flight.add(pool.submit(evaluate, next_idx))
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+            for future in in_flight:
+                if future.done() and not future.cancelled():
+                    record_result(checkpoint, future)
+            write_predictions(records, output_path)
+    return records
+
+
+def vanna_predictor(vn, allow_llm_to_see_data: bool = False):
+    """
+    predict() for the server's Vanna engine: the same single-pass generation as
+    ask_sql, so the logged prompt is the one that produced the SQL.
+    """
+    def predict(question: str):
+        generation = vn.generate_sql_with_prompt(question, allow_llm_to_see_data=allow_llm_to_see_data)
+        return generation["prompt"], generation["sql"]
+    return predict
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dev", default="dev.json")
+    parser.add_argument("--output", default="predict_dev.json")
+    parser.add_argument("--checkpoint", default=None, help="defaults to <output>.checkpoint.jsonl")
+    parser.add_argument("--debug-excel", default="vanna_sql_prompt_debug.xlsx")
+    parser.add_argument("--concurrency", type=int, default=int(os.getenv("EVAL_CONCURRENCY", "8")))
+    parser.add_argument("--flush-every", type=int, default=25)
+    parser.add_argument("--fresh", action="store_true", help="ignore the checkpoint and predict every item again")
+    parser.add_argument("--allow-llm-to-see-data", action="store_true",
+                        help="run the model's intermediate_sql queries and show it their results before it answers")
+    args = parser.parse_args()
+
+    load_dotenv()
+    from vanna_engine import create_vanna
+
+    config = {
+        "weaviate_url": os.getenv("WEAVIATE_URL"),
+        "weaviate_api_key": os.getenv("WEAVIATE_API_KEY"),
+        "vector_store": os.getenv("VECTOR_STORE", "weaviate"),
+        "local_vector_path": os.getenv("LOCAL_VECTOR_PATH", "vector_store.npz"),
+        "ddl_source": os.getenv("DDL_SOURCE", "schema"),
+        "retrieval_workers": 3 * args.concurrency,
+    }
+    with open(args.dev, 'r') as f:
+        dev_data = json.load(f)
+
+    database_path = os.getenv("SQLITE_PATH", "financial.sqlite")
+    with create_vanna(config) as vn:
+        vn.connect_to_sqlite_pool(database_path)
+        checkpoint_path = args.checkpoint or f"{os.path.splitext(args.output)[0]}.checkpoint.jsonl"
+        inputs = checkpoint_inputs(args.dev, database_path, vn.training_version.current(),
+                                   allow_llm_to_see_data=args.allow_llm_to_see_data)
+        predict = vanna_predictor(vn, allow_llm_to_see_data=args.allow_llm_to_see_data)
+        records = run_eval(dev_data, predict, checkpoint_path=checkpoint_path, output_path=args.output,
+                           concurrency=args.concurrency, flush_every=args.flush_every, inputs=inputs,
+                           resume=not args.fresh)
+
+    write_debug_excel(records, args.debug_excel)
+    print(f"\nAll predictions saved to {args.output}\n")
+    print(f"SQL prompts and queries saved to {args.debug_excel}\n")
@@ -0,0 +1,280 @@
+"""
+In-process vector store for Vanna, a drop-in replacement for WeaviateDatabase.
+
+The training corpus is small (a handful of DDL statements and documentation
+entries and a few dozen question/SQL pairs), so each collection is kept as a
+NumPy matrix of unit-length embeddings and searched with one matrix-vector
+product. The store is persisted to a local .npz snapshot.
+"""
+import json
+import logging
+import os
+import threading
+import uuid
+
+import numpy as np
+from fastembed import TextEmbedding
+
+from vanna.base import VannaBase
+
+
+class _Collection:
+    def __init__(self, dim: int = 0):
+        self.ids = []
+        self.properties = []
+        self.vectors = np.zeros((0, dim), dtype=np.float32)
+
+    def add(self, id: str, properties: dict, vector) -> None:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        if norm:
+            vector = vector / norm
+        if self.vectors.shape[0] == 0:
+            self.vectors = vector.reshape(1, -1)
+        else:
+            self.vectors = np.vstack([self.vectors, vector])
+        self.ids.append(id)
+        self.properties.append(properties)
+
+    def add_many(self, ids: list, properties: list, vectors: list) -> None:
+        matrix = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix = matrix / np.where(norms == 0, 1, norms)
+        self.vectors = matrix if self.vectors.shape[0] == 0 else np.vstack([self.vectors, matrix])
+        self.ids.extend(ids)
+        self.properties.extend(properties)
+
+    def remove(self, id: str) -> bool:
+        if id not in self.ids:
+            return False
+        position = self.ids.index(id)
+        del self.ids[position]
+        del self.properties[position]
+        self.vectors = np.delete(self.vectors, position, axis=0)
+        return True
+
+    def remove_many(self, ids: list) -> int:
+        doomed = set(ids)
+        keep = [position for position, id in enumerate(self.ids) if id not in doomed]
+        removed = len(self.ids) - len(keep)
+        if removed:
+            self.ids = [self.ids[position] for position in keep]
+            self.properties = [self.properties[position] for position in keep]
+            self.vectors = self.vectors[keep]
+        return removed
+
+    def query(self, vector, limit: int) -> list:
+        """
+        Returns (position, cosine distance) of the `limit` nearest entries, nearest first.
+        """
+        if not self.ids or limit <= 0:
+            return []
+        query = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm:
+            query = query / norm
+        scores = self.vectors @ query
+        if limit < len(scores):
+            top = np.argpartition(-scores, limit - 1)[:limit]
+        else:
+            top = np.arange(len(scores))
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(int(position), float(1.0 - scores[position])) for position in top]
+
+
+class LocalVectorStore(VannaBase):
+    """
+    VannaBase vector store backed by in-memory NumPy arrays.
+
+    Config keys: `local_vector_path` (snapshot file, "vector_store.npz" by default),
+    `local_vector_autosave` (write the snapshot after every change, on by default),
+    `n_results` and `fastembed_model`, as for WeaviateDatabase. Query results have
+    the same shape as the Weaviate ones, including the cosine `_distance`.
+
+    Another process (train_vanna.py) may rewrite the snapshot while the server
+    runs, so reads first check the file's mtime and size and reload it when it
+    has changed. Unsaved in-memory changes are lost on such a reload.
+    """
+    def __init__(self, config=None):
+        super().__init__(config=config)
+        config = config or {}
+        self.n_results = config.get("n_results", 3)
+        self.fastembed_model = config.get("fastembed_model", "BAAI/bge-small-en-v1.5")
+        self.snapshot_path = config.get("local_vector_path", "vector_store.npz")
+        self.autosave = config.get("local_vector_autosave", True)
+        self.embeddings = self._create_embedding_model()
+        self.training_data_cluster = {
+            "sql": "SQLTrainingDataEntry",
+            "ddl": "DDLEntry",
+            "doc": "DocumentationEntry"
+        }
+        self._collections = {key: _Collection() for key in self.training_data_cluster}
+        self._lock = threading.RLock()
+        self._reload_lock = threading.Lock()
+        self._snapshot_stamp = None
+        self.load()
+
+    def _create_embedding_model(self):
+        return TextEmbedding(model_name=self.fastembed_model)
+
+    def generate_embedding(self, data: str, **kwargs):
+        embedding = next(self.embeddings.embed(data))
+        return embedding.tolist()
+
+    def _file_stamp(self):
+        try:
+            st = os.stat(self.snapshot_path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def _reload_if_changed(self) -> None:
+        stamp = self._file_stamp()
+        if stamp is None or stamp == self._snapshot_stamp:
+            return
+        with self._reload_lock:
+            if self._file_stamp() != self._snapshot_stamp:
+                logging.info(f"Vector store snapshot {self.snapshot_path} changed on disk; reloading")
+                self.load()
+
+    def load(self) -> None:
+        stamp = self._file_stamp()
+        if stamp is None:
+            logging.info(f"No vector store snapshot at {self.snapshot_path}; starting empty")
+            return
+        with np.load(self.snapshot_path, allow_pickle=False) as snapshot:
+            meta = json.loads(str(snapshot["meta"]))
+            collections = {}
+            for key in self.training_data_cluster:
+                collection = _Collection()
+                entries = meta.get(key, {"ids": [], "properties": []})
+                collection.ids = list(entries["ids"])
+                collection.properties = list(entries["properties"])
+                if collection.ids:
+                    collection.vectors = snapshot[f"{key}_vectors"].astype(np.float32)
+                collections[key] = collection
+        with self._lock:
+            self._collections = collections
+            self._snapshot_stamp = stamp
+        logging.info(
+            f"Loaded vector store snapshot {self.snapshot_path}: "
+            + ", ".join(f"{len(c.ids)} {key}" for key, c in collections.items())
+        )
+
+    def save(self) -> None:
+        """
+        Writes the snapshot atomically (to a temporary file, then renamed).
+        """
+        with self._lock:
+            meta = {key: {"ids": c.ids, "properties": c.properties} for key, c in self._collections.items()}
+            arrays = {f"{key}_vectors": c.vectors for key, c in self._collections.items()}
+            tmp_path = f"{self.snapshot_path}.tmp"
+            with open(tmp_path, "wb") as f:
+                np.savez(f, meta=np.array(json.dumps(meta)), **arrays)
+            os.replace(tmp_path, self.snapshot_path)
+            self._snapshot_stamp = self._file_stamp()
+
+    def _insert_data(self, cluster_key: str, data_object: dict, vector: list) -> str:
+        id = str(uuid.uuid4())
+        self._reload_if_changed()
+        with self._lock:
+            self._collections[cluster_key].add(id, data_object, vector)
+            if self.autosave:
+                self.save()
+        return id
+
+    def _insert_many(self, cluster_key: str, data_objects: list, vectors: list, ids: list = None, **kwargs) -> list:
+        """
+        Adds many objects at once and writes the snapshot a single time. Objects
+        given an existing id replace the stored object.
+        """
+        ids = list(ids) if ids else [str(uuid.uuid4()) for _ in data_objects]
+        if not ids:
+            return ids
+        self._reload_if_changed()
+        with self._lock:
+            collection = self._collections[cluster_key]
+            collection.remove_many(ids)
+            collection.add_many(ids, list(data_objects), vectors)
+            if self.autosave:
+                self.save()
+        return ids
+
+    def _delete_many(self, cluster_key: str, ids: list) -> int:
+        self._reload_if_changed()
+        with self._lock:
+            deleted = self._collections[cluster_key].remove_many(ids)
+            if deleted and self.autosave:
+                self.save()
+        return deleted
+
+    def _clear_collection(self, cluster_key: str) -> None:
+        with self._lock:
+            self._collections[cluster_key] = _Collection()
+            if self.autosave:
+                self.save()
+
+    def add_ddl(self, ddl: str, **kwargs) -> str:
+        data_object = {
+            "description": ddl,
+        }
+        response = self._insert_data('ddl', data_object, self.generate_embedding(ddl))
+        return f'{response}-ddl'
+
+    def add_documentation(self, doc: str, **kwargs) -> str:
+        data_object = {
+            "description": doc,
+        }
+        response = self._insert_data('doc', data_object, self.generate_embedding(doc))
+        return f'{response}-doc'
+
+    def add_question_sql(self, question: str, sql: str, **kwargs) -> str:
+        data_object = {
+            "sql": sql,
+            "natural_language_question": question,
+        }
+        response = self._insert_data('sql', data_object, self.generate_embedding(question))
+        return f'{response}-sql'
+
+    def _query_collection(self, cluster_key: str, vector_input: list, return_properties: list) -> list:
+        self._reload_if_changed()
+        with self._lock:
+            collection = self._collections[cluster_key]
+            matches = collection.query(vector_input, self.n_results)
+            return [
+                {**{name: collection.properties[position].get(name) for name in return_properties},
+                 "_distance": distance}
+                for position, distance in matches
+            ]
+
+    def _collection_properties(self, cluster_key: str) -> list:
+        self._reload_if_changed()
+        with self._lock:
+            return [dict(properties) for properties in self._collections[cluster_key].properties]
+
+    def get_related_ddl(self, question: str, **kwargs) -> list:
+        response_list = self._query_collection('ddl', self.generate_embedding(question), ["description"])
+        return [item["description"] for item in response_list]
+
+    def get_related_documentation(self, question: str, **kwargs) -> list:
+        response_list = self._query_collection('doc', self.generate_embedding(question), ["description"])
+        return [item["description"] for item in response_list]
+
+    def get_similar_question_sql(self, question: str, **kwargs) -> list:
+        response_list = self._query_collection('sql', self.generate_embedding(question), ["sql", "natural_language_question"])
+        return [{"question": item["natural_language_question"], "sql": item["sql"]} for item in response_list]
+
+    def get_training_data(self, **kwargs) -> list:
+        self._reload_if_changed()
+        with self._lock:
+            return [dict(properties) for c in self._collections.values() for properties in c.properties]
+
+    def remove_training_data(self, id: str, **kwargs) -> bool:
+        for suffix in ("sql", "ddl", "doc"):
+            if id.endswith(f"-{suffix}"):
+                with self._lock:
+                    success = self._collections[suffix].remove(id[:-len(suffix) - 1])
+                    if success and self.autosave:
+                        self.save()
+                return success
+        return False
@@ -0,0 +1,323 @@
+"""
+In-process metrics for the MCP server, rendered in the Prometheus text format.
+
+Latency histograms are fed by the tracer: every finished span is recorded, the
+root span of a tool call (marked with "mcp.tool" by tracing.traced) under
+vanna_tool_duration_seconds and every other span under
+vanna_stage_duration_seconds. Token and cost counters are incremented by the
+tools. Queue depths and cache statistics are gauges read from the live objects
+when the metrics are scraped, so they cost nothing between scrapes.
+
+Recording takes one dict lookup, a bisect and a short lock per observation.
+"""
+import bisect
+import logging
+import math
+import threading
+
+import tracing
+
+# Seconds; covers cache hits (sub-millisecond) up to slow LLM calls.
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, int) or float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _CounterChild:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value += amount
+
+
+class _HistogramChild:
+    __slots__ = ("buckets", "counts", "sum", "count", "_lock")
+
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+
+class _Metric:
+    """
+    A metric family; `labels(*values)` returns the child holding one label set.
+    """
+    kind = None
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values}")
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in sorted(self._children.items()):
+            lines.extend(self._render_child(values, child))
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.labels().inc(amount)
+
+    def _render_child(self, values: tuple, child: _CounterChild) -> list:
+        return [f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.value)}"]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+    def _render_child(self, values: tuple, child: _HistogramChild) -> list:
+        with child._lock:
+            counts, total, count = list(child.counts), child.sum, child.count
+        lines, cumulative = [], 0
+        for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+            cumulative += bucket_count
+            le = f'le="{_format_value(bound)}"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, values, le)} {cumulative}")
+        labels = _format_labels(self.labelnames, values)
+        lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class CallbackGauge(_Metric):
+    """
+    A gauge whose samples come from `callback()` at scrape time: either a number,
+    or a dict mapping label value tuples to numbers.
+    """
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), callback=None):
+        super().__init__(name, documentation, labelnames)
+        self.callbacks = [callback] if callback else []
+
+    def render(self) -> list:
+        samples = {}
+        for callback in self.callbacks:
+            try:
+                value = callback()
+            except Exception as e:
+                logging.debug(f"Gauge {self.name} callback failed: {e}")
+                continue
+            samples.update(value if isinstance(value, dict) else {(): value})
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for values, value in sorted(samples.items()):
+            if value is not None:
+                lines.append(f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(value)}")
+        return lines
+
+
+class Registry:
+    """
+    Holds the metric families and renders them in the Prometheus text format.
+    """
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: tuple = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge(self, name: str, documentation: str, labelnames: tuple = (), callback=None) -> CallbackGauge:
+        """
+        Registers `callback` under the gauge `name`. Callbacks registered under the
+        same name are merged, so each session can add its own.
+        """
+        gauge = self._register(CallbackGauge(name, documentation, labelnames))
+        if callback is not None:
+            gauge.callbacks.append(callback)
+        return gauge
+
+    def remove_callback(self, name: str, callback) -> None:
+        gauge = self._metrics.get(name)
+        if gauge is not None and callback in gauge.callbacks:
+            gauge.callbacks.remove(callback)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+TOOL_SECONDS = registry.histogram("vanna_tool_duration_seconds", "Wall-clock time of MCP tool calls.", ("tool",))
+STAGE_SECONDS = registry.histogram("vanna_stage_duration_seconds", "Wall-clock time of request pipeline stages.",
+                                   ("stage",))
+TOOL_ERRORS = registry.counter("vanna_tool_errors_total", "MCP tool calls that failed, by exception type.",
+                               ("tool", "type"))
+LLM_TOKENS = registry.counter("vanna_llm_tokens_total", "LLM tokens used for SQL generation.", ("direction",))
+LLM_COST = registry.counter("vanna_llm_cost_total", "Estimated LLM cost in USD (app.calculate_cost).")
+
+
+def record_span(span) -> None:
+    """
+    Tracer listener turning finished spans into latency and error metrics.
+    """
+    seconds = (span.end_ns - span.start_ns) / 1e9
+    tool = span.attributes.get("mcp.tool")
+    if tool is None:
+        STAGE_SECONDS.labels(span.name).observe(seconds)
+        return
+    TOOL_SECONDS.labels(tool).observe(seconds)
+    if span.status == "STATUS_CODE_ERROR":
+        TOOL_ERRORS.labels(tool, span.attributes.get("error.type", "Error")).inc()
+
+
+def record_llm_usage(input_tokens: int, output_tokens: int, cost: float) -> None:
+    LLM_TOKENS.labels("input").inc(input_tokens or 0)
+    LLM_TOKENS.labels("output").inc(output_tokens or 0)
+    LLM_COST.inc(cost or 0.0)
+
+
+def enable() -> None:
+    """
+    Starts recording span latencies.
+    """
+    tracing.tracer.add_listener(record_span)
+
+
+def _hit_ratio(hits: int, lookups: int):
+    return hits / lookups if lookups else None
+
+
+def register_app_gauges(vn, query_log=None, result_cache=None):
+    """
+    Registers the queue depth and cache gauges read from a session's engine,
+    query log writer and result cache. Returns a function that unregisters them,
+    to be called when the session ends.
+    """
+    def queue_depth():
+        depths = {}
+        pool = getattr(vn, "retrieval_pool", None)
+        if pool is not None:
+            depths[("retrieval_pool",)] = pool._work_queue.qsize()
+        semaphore = getattr(vn, "_llm_semaphore", None)
+        if semaphore is not None:
+            depths[("llm_semaphore",)] = semaphore.statistics().tasks_waiting
+        if query_log is not None:
+            depths[("query_log",)] = query_log._queue.qsize()
+        return depths
+
+    def worker_threads():
+        import anyio.to_thread
+        statistics = anyio.to_thread.current_default_thread_limiter().statistics()
+        return {("busy",): statistics.borrowed_tokens, ("waiting",): statistics.tasks_waiting}
+
+    def cache_stats():
+        stats = {}
+        embedding_cache = getattr(vn, "embedding_cache", None)
+        if embedding_cache is not None:
+            stats["embedding"] = embedding_cache.stats()
+            stats["embedding"]["hit_ratio"] = _hit_ratio(stats["embedding"]["hits"],
+                                                         stats["embedding"]["hits"] + stats["embedding"]["misses"])
+        answer_cache = getattr(vn, "answer_cache", None)
+        if answer_cache is not None:
+            answer = answer_cache.stats()
+            hits = answer["exact_hits"] + answer["semantic_hits"]
+            stats["answer"] = {"hit_ratio": _hit_ratio(hits, hits + answer["misses"]), "size": answer["size"]}
+        if result_cache is not None:
+            result = result_cache.stats()
+            lookups = result["hits"] + result["misses"]
+            stats["result"] = {"hit_ratio": result["hit_ratio"] if lookups else None, "size": result["entries"]}
+        return stats
+
+    def hit_ratios():
+        return {(name,): stats["hit_ratio"] for name, stats in cache_stats().items()}
+
+    def entries():
+        return {(name,): stats["size"] for name, stats in cache_stats().items()}
+
+    callbacks = [
+        ("vanna_queue_depth", "Work waiting for a thread pool, semaphore or writer.", ("queue",), queue_depth),
+        ("vanna_worker_threads", "anyio worker threads in use and tasks waiting for one.", ("state",), worker_threads),
+        ("vanna_cache_hit_ratio", "Hits over lookups since startup.", ("cache",), hit_ratios),
+        ("vanna_cache_entries", "Entries held by each cache.", ("cache",), entries),
+    ]
+    for name, documentation, labelnames, callback in callbacks:
+        registry.gauge(name, documentation, labelnames, callback)
+
+    def unregister():
+        for name, _, _, callback in callbacks:
+            registry.remove_callback(name, callback)
+    return unregister
+
+
+def render() -> str:
+    return registry.render()
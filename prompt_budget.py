@@ -0,0 +1,111 @@
+"""
+Token-budgeted selection of the retrieved context that goes into the SQL prompt.
+"""
+import logging
+import threading
+
+# Rough per-item cost of the headers, separators and message framing that
+# get_sql_prompt wraps around each piece of context.
+ITEM_OVERHEAD_TOKENS = 4
+
+SECTIONS = ("sql", "ddl", "doc")
+
+_encodings = {}
+_encodings_lock = threading.Lock()
+
+
+def _get_encoding(name: str):
+    with _encodings_lock:
+        if name not in _encodings:
+            try:
+                import tiktoken
+                _encodings[name] = tiktoken.get_encoding(name)
+            except Exception as e:
+                # tiktoken downloads its BPE files on first use; without them fall
+                # back to the ~4 characters per token estimate Vanna itself uses.
+                logging.warning(f"tiktoken encoding '{name}' unavailable ({e}); estimating tokens from length")
+                _encodings[name] = None
+        return _encodings[name]
+
+
+def count_tokens(text: str, encoding: str = "o200k_base") -> int:
+    enc = _get_encoding(encoding)
+    if enc is None:
+        return len(text) // 4 + 1
+    return len(enc.encode(text, disallowed_special=()))
+
+
+def item_text(section: str, item) -> str:
+    if section == "sql":
+        return f"{item['question']}\n{item['sql']}"
+    return item
+
+
+class PromptBudget:
+    """
+    Fits retrieved context into `max_tokens` prompt tokens.
+
+    Candidates from all three sections (similar question/SQL pairs, DDL and
+    documentation) are ranked together by retrieval score and added greedily,
+    best first. The first documentation entry that does not fit whole is cut down
+    to the lines that do; anything else that does not fit is dropped.
+    """
+    def __init__(self, max_tokens: int = 4000, encoding: str = "o200k_base", min_truncated_tokens: int = 64):
+        self.max_tokens = max_tokens
+        self.encoding = encoding
+        self.min_truncated_tokens = min_truncated_tokens
+
+    def count(self, text: str) -> int:
+        return count_tokens(text, self.encoding)
+
+    def fit(self, fixed_tokens: int, scored: dict):
+        """
+        `fixed_tokens` is the size of the prompt without any context; `scored` maps
+        "sql"/"ddl"/"doc" to [(item, score)] lists. Returns the kept items per
+        section (in their original order) and a per-section report of kept and
+        dropped tokens.
+        """
+        candidates = []
+        for section in SECTIONS:
+            for position, (item, score) in enumerate(scored.get(section, [])):
+                tokens = self.count(item_text(section, item)) + ITEM_OVERHEAD_TOKENS
+                candidates.append((score if score is not None else 0.0, section, position, item, tokens))
+        candidates.sort(key=lambda candidate: candidate[0], reverse=True)
+
+        remaining = self.max_tokens - fixed_tokens
+        kept = {section: [] for section in SECTIONS}
+        report = {section: {"kept_tokens": 0, "dropped_tokens": 0, "kept": 0, "dropped": 0, "truncated": 0}
+                  for section in SECTIONS}
+        for _, section, position, item, tokens in candidates:
+            stats = report[section]
+            if tokens <= remaining:
+                kept[section].append((position, item))
+                remaining -= tokens
+                stats["kept_tokens"] += tokens
+                stats["kept"] += 1
+                continue
+            if section == "doc" and remaining >= self.min_truncated_tokens:
+                truncated, truncated_tokens = self._truncate_lines(item, remaining - ITEM_OVERHEAD_TOKENS)
+                if truncated:
+                    kept[section].append((position, truncated))
+                    remaining -= truncated_tokens + ITEM_OVERHEAD_TOKENS
+                    stats["kept_tokens"] += truncated_tokens + ITEM_OVERHEAD_TOKENS
+                    stats["dropped_tokens"] += tokens - truncated_tokens - ITEM_OVERHEAD_TOKENS
+                    stats["truncated"] += 1
+                    continue
+            stats["dropped_tokens"] += tokens
+            stats["dropped"] += 1
+
+        selected = {section: [item for _, item in sorted(kept[section], key=lambda pair: pair[0])]
+                    for section in SECTIONS}
+        return selected, report
+
+    def _truncate_lines(self, text: str, budget: int):
+        lines, used = [], 0
+        for line in text.splitlines():
+            line_tokens = self.count(line) + 1
+            if used + line_tokens > budget:
+                break
+            lines.append(line)
+            used += line_tokens
+        return "\n".join(lines), used
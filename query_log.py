@@ -0,0 +1,237 @@
+"""
+Append-only query log for the MCP server.
+
+Request handlers hand records to a QueryLogWriter, which queues them and writes
+them from a background thread in batches to JSONL segments. Every record carries
+a request ID: the "ask" record written by ask_sql and the "fetch" record written
+by run_sql for the same question share it, and are merged into one row when the
+log is exported to Excel.
+"""
+import glob
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future
+from datetime import datetime, timezone
+
+from tracing import span
+
+LOG_COLUMNS = [
+    "question", "prompt", "llm_input_tokens", "llm_output_tokens", "llm_cost", "sql_gen_time", "sql_query", "fetch_time", "fetch_result",
+    "retrieval_time", "sql_retrieval_time", "ddl_retrieval_time", "doc_retrieval_time",
+    "embedding_time", "embedding_cache", "answer_cache", "llm_first_token_time",
+    "result_cache", "bytes_saved", "context_tokens"
+]
+
+# Excel's sheet limit, less the header row.
+EXCEL_MAX_ROWS = 1048575
+
+_STOP = object()
+
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex
+
+
+def _sql_key(sql: str) -> str:
+    return " ".join(sql.split())
+
+
+class QueryLogWriter:
+    """
+    Batched, non-blocking writer for the query log.
+
+    `log()` only enqueues; a daemon thread writes up to `batch_size` records per
+    write to `path`, rotating it to `<name>.<n>.jsonl` once it grows past
+    `max_segment_bytes`. The segments are exported to `excel_path` on demand,
+    every `export_interval` seconds if set, and on close if asked to. The export
+    is rebuilt from the segments each time, so it is written to its own file
+    rather than to the query_log.xlsx history kept by earlier versions.
+    """
+    def __init__(self, path: str = "query_log.jsonl", excel_path: str = "query_log_export.xlsx",
+                 batch_size: int = 100, flush_interval: float = 1.0,
+                 max_segment_bytes: int = 50 * 1024 * 1024, export_interval: float = None,
+                 max_queue: int = 10000, sql_index_size: int = 4096):
+        self.path = path
+        self.excel_path = excel_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_segment_bytes = max_segment_bytes
+        self.export_interval = export_interval
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._sql_requests = OrderedDict()
+        self._sql_index_size = sql_index_size
+        self._sql_lock = threading.Lock()
+        self._thread = None
+
+    def start(self) -> "QueryLogWriter":
+        self._thread = threading.Thread(target=self._run, name="query-log-writer", daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self, export: bool = False) -> None:
+        """
+        Flushes pending records and stops the writer thread; with `export`, the log
+        is exported to Excel one last time first.
+        """
+        if self._thread is None:
+            return
+        if export:
+            self.request_export()
+        self._queue.put(_STOP)
+        self._thread.join()
+        self._thread = None
+
+    def log(self, record: dict) -> None:
+        """
+        Queues a record without blocking the caller. The record should carry a
+        "request_id" and an "event" ("ask" or "fetch").
+        """
+        record.setdefault("timestamp", datetime.now(timezone.utc).isoformat())
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            logging.warning(f"Query log queue is full; dropped record {record.get('request_id')}")
+
+    def remember_sql(self, sql: str, request_id: str) -> None:
+        """
+        Records which request generated `sql`, so a later run_sql of the same
+        query can attach its timings to that request.
+        """
+        if not sql:
+            return
+        key = _sql_key(sql)
+        with self._sql_lock:
+            self._sql_requests[key] = request_id
+            self._sql_requests.move_to_end(key)
+            while len(self._sql_requests) > self._sql_index_size:
+                self._sql_requests.popitem(last=False)
+
+    def request_id_for_sql(self, sql: str):
+        with self._sql_lock:
+            return self._sql_requests.get(_sql_key(sql))
+
+    def request_export(self, excel_path: str = None) -> Future:
+        """
+        Asks the writer thread to export the log to Excel after everything queued
+        so far has been written. Returns a Future resolving to the export path.
+        """
+        future = Future()
+        self._queue.put((future, excel_path or self.excel_path))
+        return future
+
+    def _run(self) -> None:
+        batch = []
+        batch_started = last_export = time.monotonic()
+        while True:
+            timeout = self.flush_interval
+            if batch:
+                timeout = max(0.0, batch_started + self.flush_interval - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            if isinstance(item, dict):
+                if not batch:
+                    batch_started = time.monotonic()
+                batch.append(item)
+                if len(batch) < self.batch_size and time.monotonic() - batch_started < self.flush_interval:
+                    continue
+            stop = item is _STOP
+            if batch:
+                self._write_batch(batch)
+                batch = []
+            if isinstance(item, tuple):
+                future, excel_path = item
+                self._export(future, excel_path)
+                last_export = time.monotonic()
+            elif self.export_interval and time.monotonic() - last_export >= self.export_interval:
+                self._export(Future(), self.excel_path)
+                last_export = time.monotonic()
+            if stop:
+                return
+
+    def _write_batch(self, batch: list) -> None:
+        try:
+            with span("query_log.write_batch", records=len(batch)), open(self.path, "a", encoding="utf-8") as f:
+                f.write("".join(json.dumps(record, default=str) + "\n" for record in batch))
+            if os.path.getsize(self.path) >= self.max_segment_bytes:
+                self._rotate()
+        except Exception as e:
+            logging.error(f"Error writing query log batch: {e}")
+
+    def _rotated_segments(self) -> list:
+        """
+        Returns (index, path) for the rotated segments, oldest first.
+        """
+        root, ext = os.path.splitext(self.path)
+        segments = []
+        for path in glob.glob(f"{glob.escape(root)}.*{ext}"):
+            suffix = path[len(root) + 1:len(path) - len(ext)]
+            if suffix.isdigit():
+                segments.append((int(suffix), path))
+        return sorted(segments)
+
+    def segment_paths(self) -> list:
+        """
+        All segments of the log, oldest first, ending with the active one.
+        """
+        return [path for _, path in self._rotated_segments()] + [self.path]
+
+    def _rotate(self) -> None:
+        root, ext = os.path.splitext(self.path)
+        segments = self._rotated_segments()
+        next_index = segments[-1][0] + 1 if segments else 1
+        os.replace(self.path, f"{root}.{next_index}{ext}")
+
+    def _export(self, future: Future, excel_path: str) -> None:
+        try:
+            with span("query_log.export_excel"):
+                export_to_excel(self.segment_paths(), excel_path)
+            future.set_result(excel_path)
+        except Exception as e:
+            logging.error(f"Error exporting query log to Excel: {e}")
+            future.set_exception(e)
+
+
+def read_records(paths: list):
+    """
+    Yields the records of the given JSONL segments in order, skipping missing files.
+    """
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def export_to_excel(paths: list, excel_path: str) -> str:
+    """
+    Merges the ask/fetch records of each request into one row and writes them to
+    `excel_path`. Fetches of a request run more than once keep the latest timing.
+    Only the latest EXCEL_MAX_ROWS requests fit in the sheet; older ones stay in
+    the JSONL segments.
+    """
+    import pandas as pd
+
+    rows = OrderedDict()
+    for record in read_records(paths):
+        request_id = record.get("request_id") or new_request_id()
+        row = rows.setdefault(request_id, {"request_id": request_id, "timestamp": record.get("timestamp")})
+        row.update({key: value for key, value in record.items() if key in LOG_COLUMNS})
+    rows = list(rows.values())
+    if len(rows) > EXCEL_MAX_ROWS:
+        logging.warning(f"Query log has {len(rows)} requests; exporting the latest {EXCEL_MAX_ROWS} to {excel_path}")
+        rows = rows[-EXCEL_MAX_ROWS:]
+    df = pd.DataFrame(rows, columns=["request_id", "timestamp"] + LOG_COLUMNS)
+    df.to_excel(excel_path, index=False)
+    return excel_path
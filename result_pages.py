@@ -0,0 +1,128 @@
+"""
+Server-side cursors for paginated run_sql results.
+
+A paginated query keeps its own read-only SQLite connection and cursor open
+between calls and only ever materializes one page of rows, so memory use is
+bounded by the page size rather than the size of the result.
+"""
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from sqlite_pool import QueryBudget
+
+
+class PagedResult:
+    def __init__(self, connection: sqlite3.Connection, cursor: sqlite3.Cursor, page_size: int, expires_at: float):
+        self.connection = connection
+        self.cursor = cursor
+        self.columns = [column[0] for column in cursor.description or []]
+        self.page_size = page_size
+        self.row_offset = 0
+        self.expires_at = expires_at
+        self.lock = threading.Lock()
+
+    def close(self) -> None:
+        try:
+            self.cursor.close()
+            self.connection.close()
+        except sqlite3.Error as e:
+            logging.warning(f"Error closing paginated cursor: {e}")
+
+
+class CursorRegistry:
+    """
+    Open paginated results, keyed by continuation token. `connect` opens the
+    dedicated read-only connection each result runs on.
+
+    At most `max_open` cursors are kept; opening another closes the least recently
+    used one. A cursor is closed when its last page has been read or when it has
+    not been used for `ttl` seconds.
+    """
+    def __init__(self, connect, max_open: int = 32, ttl: float = 300):
+        self.connect = connect
+        self.max_open = max_open
+        self.ttl = ttl
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+
+    def open(self, sql: str, page_size: int, timeout: float = None, cancel_event: threading.Event = None) -> dict:
+        """
+        Executes `sql` and returns its first page. Blocking; call it from a worker thread.
+        Each page fetch is bounded by `timeout` seconds and aborted when
+        `cancel_event` is set (see QueryBudget).
+        """
+        if page_size <= 0:
+            raise ValueError("page_size must be a positive integer")
+        connection = self.connect()
+        try:
+            with QueryBudget(connection, timeout=timeout, cancel_event=cancel_event):
+                cursor = connection.execute(sql)
+        except Exception:
+            connection.close()
+            raise
+        result = PagedResult(connection, cursor, page_size, time.monotonic() + self.ttl)
+        token = uuid.uuid4().hex
+        with self._lock:
+            self._expire()
+            while len(self._results) >= self.max_open:
+                _, oldest = self._results.popitem(last=False)
+                oldest.close()
+            self._results[token] = result
+        return self._next_page(token, result, timeout, cancel_event)
+
+    def fetch(self, token: str, timeout: float = None, cancel_event: threading.Event = None) -> dict:
+        """
+        Returns the next page of an open result. Blocking; call it from a worker thread.
+        """
+        with self._lock:
+            self._expire()
+            result = self._results.get(token)
+            if result is None:
+                raise KeyError(f"Unknown or expired continuation token: {token}")
+            self._results.move_to_end(token)
+            result.expires_at = time.monotonic() + self.ttl
+        return self._next_page(token, result, timeout, cancel_event)
+
+    def close(self, token: str) -> None:
+        with self._lock:
+            result = self._results.pop(token, None)
+        if result is not None:
+            result.close()
+
+    def close_all(self) -> None:
+        with self._lock:
+            results = list(self._results.values())
+            self._results.clear()
+        for result in results:
+            result.close()
+
+    def _next_page(self, token: str, result: PagedResult, timeout: float = None,
+                   cancel_event: threading.Event = None) -> dict:
+        with result.lock:
+            try:
+                with QueryBudget(result.connection, timeout=timeout, cancel_event=cancel_event):
+                    rows = result.cursor.fetchmany(result.page_size)
+            except Exception:
+                self.close(token)
+                raise
+            row_offset = result.row_offset
+            result.row_offset += len(rows)
+        done = len(rows) < result.page_size
+        if done:
+            self.close(token)
+        return {
+            "columns": result.columns,
+            "rows": [dict(zip(result.columns, row)) for row in rows],
+            "row_offset": row_offset,
+            "next_token": None if done else token,
+        }
+
+    def _expire(self) -> None:
+        now = time.monotonic()
+        expired = [token for token, result in self._results.items() if result.expires_at <= now]
+        for token in expired:
+            self._results.pop(token).close()
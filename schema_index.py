@@ -0,0 +1,206 @@
+"""
+In-process index of the SQLite schema, used to pick the DDL that goes into the
+SQL prompt without a vector search.
+
+The index is read once from the live catalog (sqlite_master, PRAGMA table_info and
+PRAGMA foreign_key_list). The financial database declares no foreign keys, so
+`<table>_id` columns are also treated as references to the table of that name,
+as the documentation describes them.
+"""
+import heapq
+import logging
+import re
+import sqlite3
+import time
+
+from sqlite_pool import read_only_uri
+
+# Words and phrases that refer to a table of the financial database without naming it.
+DEFAULT_SYNONYMS = {
+    "account": ["accounts"],
+    "card": ["cards", "credit card", "credit cards"],
+    "client": ["clients", "customer", "customers"],
+    "disp": ["disposition", "dispositions", "owner", "owners", "disponent", "disponents"],
+    "district": ["districts", "region", "regions", "branch", "branches", "inhabitants", "municipalities",
+                 "salary", "unemployment", "crimes"],
+    "loan": ["loans"],
+    "order": ["orders", "standing order", "standing orders", "permanent order", "permanent orders"],
+    "trans": ["transaction", "transactions", "withdrawal", "withdrawals", "credits", "debits"],
+}
+
+# Column names that are also everyday words, so finding one in a question says
+# little about the table ("How many clients does the bank have?" is not about
+# trans.bank). They select their table only when qualified by it ("trans bank",
+# "trans.bank"), which the table name already does.
+COMMON_WORDS = frozenset({
+    "amount", "balance", "bank", "category", "code", "count", "date", "day", "description", "issued", "kind",
+    "level", "month", "name", "number", "operation", "payments", "price", "rate", "size", "status", "time",
+    "total", "type", "value", "year",
+})
+
+# Extra cost of a join path that goes up a foreign key and back down another one
+# through a shared parent (client -> district <- account), which relates rows by
+# a common attribute rather than linking them. Not charged when the path came up
+# from a link table, one that references two or more tables (client <- disp ->
+# account <- loan).
+FAN_TRAP_PENALTY = 2
+
+_WORD = re.compile(r"[a-z0-9_]+")
+
+
+def _phrase_pattern(phrase: str):
+    words = phrase.lower().replace("_", " ").split()
+    return re.compile(r"\b" + r"[\s_]+".join(re.escape(word) for word in words) + r"\b")
+
+
+class SchemaIndex:
+    """
+    Tables, columns and the foreign key graph of a SQLite database.
+
+    `select(question)` returns the tables the question mentions (by name, synonym
+    or a distinctive column name unique to one table) plus the tables on the cheapest join
+    paths between them.
+    """
+    def __init__(self, ddl: dict, columns: dict, references: dict, synonyms: dict = None):
+        self.ddl = ddl  # table -> CREATE statement
+        self.columns = columns  # table -> [column names]
+        self.references = references  # child table -> {parent table: [(child column, parent column)]}
+        self.referenced_by = {table: set() for table in ddl}
+        for child, parents in references.items():
+            for parent in parents:
+                self.referenced_by[parent].add(child)
+        self._patterns = self._build_patterns(synonyms if synonyms is not None else DEFAULT_SYNONYMS)
+
+    @classmethod
+    def from_connection(cls, conn: sqlite3.Connection, synonyms: dict = None) -> "SchemaIndex":
+        started = time.perf_counter()
+        rows = conn.execute(
+            "SELECT name, sql FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name"
+        ).fetchall()
+        ddl = {name: sql for name, sql in rows}
+        columns, references = {}, {}
+        for table in ddl:
+            quoted = table.replace('"', '""')
+            columns[table] = [row[1] for row in conn.execute(f'PRAGMA table_info("{quoted}")')]
+            for row in conn.execute(f'PRAGMA foreign_key_list("{quoted}")'):
+                parent, child_column, parent_column = row[2], row[3], row[4]
+                if parent in ddl:
+                    references.setdefault(table, {}).setdefault(parent, []).append((child_column, parent_column or child_column))
+        for table, table_columns in columns.items():
+            for column in table_columns:
+                parent = column[:-3] if column.lower().endswith("_id") else None
+                if parent is None or parent == table or parent not in ddl or column not in columns[parent]:
+                    continue
+                links = references.setdefault(table, {}).setdefault(parent, [])
+                if all(child_column != column for child_column, _ in links):
+                    links.append((column, column))
+        index = cls(ddl, columns, references, synonyms)
+        logging.info(
+            f"Schema index: {len(ddl)} tables, {sum(len(p) for p in references.values())} references "
+            f"in {time.perf_counter() - started:.4f}s"
+        )
+        return index
+
+    @classmethod
+    def from_sqlite(cls, database_path: str, synonyms: dict = None) -> "SchemaIndex":
+        conn = sqlite3.connect(read_only_uri(database_path), uri=True)
+        try:
+            return cls.from_connection(conn, synonyms)
+        finally:
+            conn.close()
+
+    def _build_patterns(self, synonyms: dict) -> list:
+        """
+        (pattern, table) pairs: table names and synonyms first, then column names
+        that belong to exactly one table and are not ids, table names or
+        COMMON_WORDS.
+        """
+        patterns = []
+        for table in self.ddl:
+            for phrase in [table] + list(synonyms.get(table, [])):
+                patterns.append((_phrase_pattern(phrase), table))
+        owners = {}
+        for table, table_columns in self.columns.items():
+            for column in table_columns:
+                owners.setdefault(column.lower(), set()).add(table)
+        for column, tables in sorted(owners.items()):
+            if (len(tables) == 1 and not column.endswith("_id") and column not in self.ddl
+                    and column not in COMMON_WORDS):
+                patterns.append((_phrase_pattern(column), next(iter(tables))))
+        return patterns
+
+    def mentioned_tables(self, question: str) -> list:
+        text = " ".join(_WORD.findall(question.lower()))
+        mentioned = []
+        for pattern, table in self._patterns:
+            if table not in mentioned and pattern.search(text):
+                mentioned.append(table)
+        return mentioned
+
+    def _neighbours(self, table: str):
+        for parent in self.references.get(table, {}):
+            yield parent, True  # following a foreign key up to the referenced table
+        for child in self.referenced_by.get(table, ()):
+            yield child, False
+
+    def join_path(self, source: str, targets: set) -> list:
+        """
+        Cheapest path from `source` to any table in `targets` over the foreign key
+        graph, as a list of tables; empty if none is reachable.
+        """
+        heap = [(0, source, False, [source])]
+        best = {}
+        while heap:
+            cost, table, pivoting, path = heapq.heappop(heap)
+            if table in targets:
+                return path
+            if best.get((table, pivoting), float("inf")) <= cost:
+                continue
+            best[(table, pivoting)] = cost
+            is_link = len(self.references.get(table, {})) >= 2
+            for neighbour, going_up in sorted(self._neighbours(table)):
+                if neighbour in path:
+                    continue
+                step = 1 + (FAN_TRAP_PENALTY if pivoting and not going_up else 0)
+                heapq.heappush(heap, (cost + step, neighbour, going_up and not is_link, path + [neighbour]))
+        return []
+
+    def select(self, question: str) -> tuple:
+        """
+        Returns (mentioned tables, join tables added to connect them).
+        """
+        mentioned = self.mentioned_tables(question)
+        if len(mentioned) < 2:
+            return mentioned, []
+        connected = {mentioned[0]}
+        joins = []
+        for table in mentioned[1:]:
+            if table in connected:
+                continue
+            for step in self.join_path(table, connected):
+                if step not in connected:
+                    connected.add(step)
+                    if step not in mentioned:
+                        joins.append(step)
+        return mentioned, joins
+
+    def table_ddl(self, table: str, selected: set) -> str:
+        """
+        The table's CREATE statement followed by the joins to other selected tables.
+        """
+        lines = [self.ddl[table]]
+        for parent, links in sorted(self.references.get(table, {}).items()):
+            if parent in selected:
+                for child_column, parent_column in links:
+                    lines.append(f"-- join: {table}.{child_column} = {parent}.{parent_column}")
+        return "\n".join(lines)
+
+    def related_ddl(self, question: str) -> list:
+        """
+        [(ddl, score)] for the selected tables; mentioned tables score 1.0 and join
+        tables slightly less. Empty when the question names no table.
+        """
+        mentioned, joins = self.select(question)
+        selected = set(mentioned) | set(joins)
+        return ([(self.table_ddl(table, selected), 1.0) for table in mentioned]
+                + [(self.table_ddl(table, selected), 0.99) for table in joins])
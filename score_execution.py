@@ -0,0 +1,236 @@
+"""
+Execution accuracy of predict_dev.json against the gold SQL in dev.json.
+
+A prediction is correct when it returns the same rows as the gold query, in any
+order, with duplicates counted. Each result set is reduced to a fingerprint while
+it is fetched: the row count plus the sum of one 128-bit hash per row. Equal
+multisets of rows always have equal fingerprints, so result sets are compared
+without holding them in memory or comparing rows pairwise.
+
+Pairs run in a process pool. The database is copied once to a temporary file that
+every worker opens read-only and immutable (no locking, since nothing can write
+it), and each query runs under a time budget (QueryBudget from sqlite_pool), so a
+runaway prediction cannot hold up the run or touch financial.sqlite.
+
+Usage:
+    python score_execution.py [--predictions predict_dev.json] [--dev dev.json] [--db financial.sqlite]
+                              [--workers 4] [--timeout 30] [--report execution_report.json]
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from sqlite_pool import QueryBudget, QueryTimeout, read_only_uri
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+PREDICTION_SEPARATOR = "\t----- bird -----\t"
+DIFFICULTIES = ("simple", "moderate", "challenging")
+HASH_MODULUS = 1 << 128
+
+# The worker process's read-only connection, opened by _init_worker.
+_conn = None
+
+
+def parse_prediction(value: str) -> tuple:
+    """
+    Splits a predict_dev.json value ("sql\\t----- bird -----\\tdb_id") into (sql, db_id).
+    """
+    sql, _, db_id = value.partition(PREDICTION_SEPARATOR)
+    return sql.strip(), db_id.strip()
+
+
+def _normalize(value):
+    # 3 and 3.0 compare equal in Python, so they must hash equally too.
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def row_hash(row: tuple) -> int:
+    payload = repr(tuple(_normalize(value) for value in row)).encode("utf-8")
+    return int.from_bytes(hashlib.blake2b(payload, digest_size=16).digest(), "big")
+
+
+def result_fingerprint(conn: sqlite3.Connection, sql: str, timeout: float = None) -> dict:
+    """
+    Runs `sql` and returns {"rows", "hash", "seconds"}. The hash is the sum of the
+    row hashes modulo 2**128, which is independent of row order.
+    """
+    start = time.time()
+    rows, total = 0, 0
+    with QueryBudget(conn, timeout=timeout) as budget:
+        cursor = conn.execute(sql)
+        while True:
+            chunk = cursor.fetchmany(1000)
+            if not chunk:
+                break
+            for row in chunk:
+                total = (total + row_hash(row)) % HASH_MODULUS
+            rows += len(chunk)
+            budget.rows_returned += len(chunk)
+    return {"rows": rows, "hash": total, "seconds": time.time() - start}
+
+
+def _init_worker(path: str) -> None:
+    global _conn
+    _conn = sqlite3.connect(read_only_uri(path, immutable=True), uri=True)
+    _conn.execute("PRAGMA query_only = ON")
+
+
+def _execute(sql: str, timeout: float) -> dict:
+    try:
+        return result_fingerprint(_conn, sql, timeout=timeout)
+    except QueryTimeout as e:
+        return {"error": "timeout", "seconds": e.elapsed}
+    except (sqlite3.Error, ValueError) as e:
+        return {"error": f"{type(e).__name__}: {e}", "seconds": 0.0}
+
+
+def score_pair(task: dict) -> dict:
+    """
+    Executes one predicted/gold pair in a worker process.
+    """
+    gold = _execute(task["gold_sql"], task["timeout"])
+    predicted = _execute(task["predicted_sql"], task["timeout"])
+    correct = (
+        "error" not in gold and "error" not in predicted
+        and gold["rows"] == predicted["rows"] and gold["hash"] == predicted["hash"]
+    )
+    return {
+        "idx": task["idx"],
+        "difficulty": task["difficulty"],
+        "correct": correct,
+        "gold_seconds": gold["seconds"],
+        "predicted_seconds": predicted["seconds"],
+        "gold_rows": gold.get("rows"),
+        "predicted_rows": predicted.get("rows"),
+        "gold_error": gold.get("error"),
+        "predicted_error": predicted.get("error"),
+    }
+
+
+def build_tasks(predictions: dict, dev_data: list, db_id: str = None, timeout: float = 30.0) -> list:
+    """
+    Pairs every prediction with its dev.json item. With `db_id`, only questions
+    about that database are kept.
+    """
+    tasks = []
+    for key, value in predictions.items():
+        idx = int(key)
+        item = dev_data[idx]
+        if db_id and item.get("db_id") != db_id:
+            continue
+        predicted_sql, _ = parse_prediction(value)
+        tasks.append({
+            "idx": idx,
+            "difficulty": item.get("difficulty", "unknown"),
+            "gold_sql": item.get("SQL", ""),
+            "predicted_sql": predicted_sql,
+            "timeout": timeout,
+        })
+    return tasks
+
+
+def percentile(values: list, fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def summarize(results: list) -> dict:
+    """
+    Accuracy overall and per difficulty tier, plus execution time statistics.
+    """
+    tiers = {}
+    for result in results:
+        tier = tiers.setdefault(result["difficulty"], {"total": 0, "correct": 0})
+        tier["total"] += 1
+        tier["correct"] += result["correct"]
+    for tier in tiers.values():
+        tier["accuracy"] = tier["correct"] / tier["total"]
+    correct = sum(result["correct"] for result in results)
+    predicted_seconds = [result["predicted_seconds"] for result in results]
+    gold_seconds = [result["gold_seconds"] for result in results]
+    return {
+        "total": len(results),
+        "correct": correct,
+        "accuracy": correct / len(results) if results else 0.0,
+        "by_difficulty": tiers,
+        "timeouts": sum(result["predicted_error"] == "timeout" for result in results),
+        "errors": sum(bool(result["predicted_error"]) and result["predicted_error"] != "timeout" for result in results),
+        "predicted_seconds": {"p50": percentile(predicted_seconds, 0.5), "p95": percentile(predicted_seconds, 0.95),
+                              "max": max(predicted_seconds, default=0.0)},
+        "gold_seconds": {"p50": percentile(gold_seconds, 0.5), "p95": percentile(gold_seconds, 0.95),
+                         "max": max(gold_seconds, default=0.0)},
+    }
+
+
+def score(tasks: list, database_path: str, workers: int = 4) -> list:
+    """
+    Scores the tasks in `workers` processes sharing one read-only copy of the
+    database. Returns the per-query results ordered by idx.
+    """
+    results = []
+    with tempfile.TemporaryDirectory(prefix="score_execution_") as copy_dir:
+        path = os.path.join(copy_dir, os.path.basename(database_path))
+        shutil.copyfile(database_path, path)
+        os.chmod(path, 0o444)
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(path,)) as pool:
+            futures = [pool.submit(score_pair, task) for task in tasks]
+            for done, future in enumerate(as_completed(futures), start=1):
+                results.append(future.result())
+                if done % 50 == 0 or done == len(futures):
+                    logging.info(f"Scored {done}/{len(futures)}")
+    return sorted(results, key=lambda result: result["idx"])
+
+
+def print_summary(summary: dict) -> None:
+    print(f"\nExecution accuracy: {summary['accuracy']:.2%} ({summary['correct']}/{summary['total']})")
+    tiers = [tier for tier in DIFFICULTIES if tier in summary["by_difficulty"]]
+    tiers += sorted(tier for tier in summary["by_difficulty"] if tier not in DIFFICULTIES)
+    for tier in tiers:
+        stats = summary["by_difficulty"][tier]
+        print(f"  {tier:<12} {stats['accuracy']:7.2%}  ({stats['correct']}/{stats['total']})")
+    print(f"Predicted SQL errors: {summary['errors']}, timeouts: {summary['timeouts']}")
+    for side in ("predicted", "gold"):
+        seconds = summary[f"{side}_seconds"]
+        print(f"{side.capitalize()} SQL time: p50 {seconds['p50']:.3f}s, p95 {seconds['p95']:.3f}s, "
+              f"max {seconds['max']:.3f}s")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--predictions", default="predict_dev.json")
+    parser.add_argument("--dev", default="dev.json")
+    parser.add_argument("--db", default=os.getenv("SQLITE_PATH", "financial.sqlite"))
+    parser.add_argument("--db-id", default="financial", help="score only questions about this database ('' for all)")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--timeout", type=float, default=30.0, help="seconds per query")
+    parser.add_argument("--report", default="execution_report.json")
+    args = parser.parse_args()
+
+    with open(args.predictions) as f:
+        predictions = json.load(f)
+    with open(args.dev) as f:
+        dev_data = json.load(f)
+
+    tasks = build_tasks(predictions, dev_data, db_id=args.db_id, timeout=args.timeout)
+    logging.info(f"Scoring {len(tasks)} predictions with {args.workers} workers against {args.db}")
+    start = time.time()
+    results = score(tasks, args.db, workers=args.workers)
+    summary = summarize(results)
+    summary["seconds"] = time.time() - start
+
+    with open(args.report, "w") as f:
+        json.dump({"summary": summary, "queries": results}, f, indent=2)
+    print_summary(summary)
+    print(f"\nPer-query results saved to {args.report} ({summary['seconds']:.1f}s)\n")
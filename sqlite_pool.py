@@ -0,0 +1,208 @@
+"""
+Pooled, read-only SQLite connections for run_sql.
+
+Each worker thread gets its own connection, opened with a `mode=ro` URI and tuned
+with the configured pragmas, so concurrent queries no longer serialize on one
+shared connection. Queries run under a QueryBudget, which aborts them through
+SQLite's progress handler once their wall-clock budget is spent or their caller
+has gone away.
+"""
+import logging
+import pathlib
+import sqlite3
+import threading
+import time
+import weakref
+from typing import TYPE_CHECKING
+
+from tracing import span
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# SQLite VM instructions between two progress handler calls. Small enough that a
+# timeout or cancellation is noticed within a few milliseconds.
+PROGRESS_STEPS = 10000
+
+
+def read_only_uri(database_path: str, immutable: bool = False) -> str:
+    """
+    SQLite URI opening `database_path` read-only. The path is percent-encoded, so
+    names containing "?", "#" or "%" open the right file. `immutable` also tells
+    SQLite the file cannot change, so it skips locking.
+    """
+    uri = pathlib.Path(database_path).resolve().as_uri() + "?mode=ro"
+    return uri + "&immutable=1" if immutable else uri
+
+
+class QueryTimeout(Exception):
+    """
+    Raised when a query is aborted for exceeding its time budget or because it was
+    cancelled. SQLite does not expose scan counters to Python, so the work done is
+    reported as rows returned so far plus (approximate) VM instructions executed.
+    """
+    def __init__(self, elapsed: float, timeout: float, rows_returned: int, vm_steps: int, cancelled: bool = False):
+        self.elapsed = elapsed
+        self.timeout = timeout
+        self.rows_returned = rows_returned
+        self.vm_steps = vm_steps
+        self.cancelled = cancelled
+        reason = "cancelled" if cancelled else f"exceeded its {timeout}s budget"
+        super().__init__(f"Query {reason} after {elapsed:.3f}s ({rows_returned} rows returned)")
+
+    def to_dict(self) -> dict:
+        return {
+            "error": "cancelled" if self.cancelled else "timeout",
+            "elapsed": self.elapsed,
+            "timeout": self.timeout,
+            "rows_returned": self.rows_returned,
+            "vm_steps": self.vm_steps,
+        }
+
+
+class QueryBudget:
+    """
+    Context manager that installs a progress handler on `conn` for the duration of
+    a query. The handler interrupts the query once `timeout` seconds have passed or
+    `cancel_event` is set, and the resulting "interrupted" error is re-raised as
+    QueryTimeout. Callers add fetched rows to `rows_returned`.
+    """
+    def __init__(self, conn: sqlite3.Connection, timeout: float = None, cancel_event: threading.Event = None):
+        self.conn = conn
+        self.timeout = timeout
+        self.cancel_event = cancel_event
+        self.rows_returned = 0
+        self.vm_steps = 0
+        self.cancelled = False
+        self.timed_out = False
+
+    def _check(self) -> int:
+        self.vm_steps += PROGRESS_STEPS
+        if self.cancel_event is not None and self.cancel_event.is_set():
+            self.cancelled = True
+            return 1
+        if self._deadline is not None and time.monotonic() > self._deadline:
+            self.timed_out = True
+            return 1
+        return 0
+
+    def __enter__(self) -> "QueryBudget":
+        self._start = time.monotonic()
+        self._deadline = self._start + self.timeout if self.timeout else None
+        if self._deadline is not None or self.cancel_event is not None:
+            self.conn.set_progress_handler(self._check, PROGRESS_STEPS)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.conn.set_progress_handler(None, 0)
+        if isinstance(exc_val, sqlite3.OperationalError) and (self.cancelled or self.timed_out):
+            raise QueryTimeout(
+                elapsed=time.monotonic() - self._start,
+                timeout=self.timeout,
+                rows_returned=self.rows_returned,
+                vm_steps=self.vm_steps,
+                cancelled=self.cancelled,
+            ) from exc_val
+        return False
+
+
+class _ThreadConnection:
+    # Held only by a thread's thread-local storage, so it is collected when the
+    # thread exits, and its finalizer closes the connection.
+    __slots__ = ("connection", "__weakref__")
+
+    def __init__(self, connection: sqlite3.Connection):
+        self.connection = connection
+
+
+class SQLiteReadPool:
+    """
+    One read-only connection per thread, created on first use and closed when
+    the thread exits (anyio retires idle worker threads and starts new ones).
+
+    `mmap_size` (bytes), `cache_size` (SQLite semantics: negative values are KiB)
+    and `temp_store` are applied to every connection. With `enable_wal`, the
+    database is switched to WAL journaling once, through a short-lived writable
+    connection, so readers never block on a writer.
+    """
+    def __init__(self, database_path: str, mmap_size: int = 256 * 1024 * 1024, cache_size: int = -64 * 1024,
+                 temp_store: str = "MEMORY", enable_wal: bool = False):
+        self.database_path = database_path
+        self.mmap_size = mmap_size
+        self.cache_size = cache_size
+        self.temp_store = temp_store
+        self._local = threading.local()
+        self._connections = set()
+        self._lock = threading.Lock()
+        if enable_wal:
+            self._enable_wal()
+
+    def _enable_wal(self) -> None:
+        try:
+            with sqlite3.connect(self.database_path) as conn:
+                mode = conn.execute("PRAGMA journal_mode=WAL").fetchone()[0]
+            logging.info(f"SQLite journal mode: {mode}")
+        except sqlite3.Error as e:
+            logging.warning(f"Could not switch {self.database_path} to WAL: {e}")
+
+    def connect(self) -> sqlite3.Connection:
+        """
+        Opens a new tuned read-only connection that the caller owns and must close.
+        """
+        conn = sqlite3.connect(read_only_uri(self.database_path), uri=True, check_same_thread=False)
+        conn.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+        conn.execute(f"PRAGMA cache_size={int(self.cache_size)}")
+        conn.execute(f"PRAGMA temp_store={self.temp_store}")
+        return conn
+
+    def connection(self) -> sqlite3.Connection:
+        """
+        Returns the calling thread's pooled connection.
+        """
+        holder = getattr(self._local, "holder", None)
+        if holder is None:
+            conn = self.connect()
+            holder = _ThreadConnection(conn)
+            self._local.holder = holder
+            with self._lock:
+                self._connections.add(conn)
+            weakref.finalize(holder, self._release, conn)
+        return holder.connection
+
+    def _release(self, conn: sqlite3.Connection) -> None:
+        with self._lock:
+            if conn not in self._connections:
+                return  # already closed by close()
+            self._connections.discard(conn)
+        conn.close()
+
+    def run_sql(self, sql: str, timeout: float = None, cancel_event: threading.Event = None, **kwargs) -> "pd.DataFrame":
+        """
+        Runs `sql` on the calling thread's connection and returns the rows as a
+        DataFrame. Raises QueryTimeout when `timeout` seconds pass or `cancel_event`
+        is set before the query finishes.
+        """
+        import pandas as pd
+
+        conn = self.connection()
+        with span("sqlite.execute") as execute_span, \
+                QueryBudget(conn, timeout=timeout, cancel_event=cancel_event) as budget:
+            cursor = conn.execute(sql)
+            columns = [column[0] for column in cursor.description or []]
+            rows = []
+            while True:
+                chunk = cursor.fetchmany(1000)
+                if not chunk:
+                    break
+                rows.extend(chunk)
+                budget.rows_returned += len(chunk)
+            execute_span.set_attribute("sqlite.rows", len(rows))
+        with span("sqlite.dataframe"):
+            return pd.DataFrame.from_records(rows, columns=columns, coerce_float=True)
+
+    def close(self) -> None:
+        with self._lock:
+            connections, self._connections = self._connections, set()
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
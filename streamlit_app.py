@@ -8,6 +8,9 @@ if 'recent_questions' not in st.session_state:
     st.session_state['recent_questions'] = []
 if 'recent_sqls' not in st.session_state:
     st.session_state['recent_sqls'] = []
+# Request IDs of the generated queries, so /execute logs under the right request
+if 'request_ids' not in st.session_state:
+    st.session_state['request_ids'] = {}
 
 st.title("Vanna AI MCP Streamlit UI")
 
@@ -33,9 +36,17 @@ if endpoint == "/context":
     st.header("View Model Context (/context)")
     if st.button("Fetch Context"):
         try:
-            resp = requests.get(f"{API_URL}/context")
-            resp.raise_for_status()
-            data = resp.json()
+            # Revalidate the previous copy: the server answers 304 while the context is unchanged.
+            cached = st.session_state.get('context')
+            headers = {"If-None-Match": cached["etag"]} if cached else {}
+            resp = requests.get(f"{API_URL}/context", headers=headers)
+            if resp.status_code == 304 and cached:
+                data = cached["data"]
+            else:
+                resp.raise_for_status()
+                data = resp.json()
+                if resp.headers.get("ETag"):
+                    st.session_state['context'] = {"etag": resp.headers["ETag"], "data": data}
             st.subheader("Schema (DDL)")
             for ddl in data.get("schema", []):
                 st.code(ddl, language="sql")
@@ -67,6 +78,12 @@ elif endpoint == "/generate":
                     st.session_state['recent_questions'] = st.session_state['recent_questions'][-3:]
                     st.session_state['recent_sqls'].append(data.get("sql", "No SQL returned."))
                     st.session_state['recent_sqls'] = st.session_state['recent_sqls'][-3:]
+                    if "sql" in data:
+                        st.session_state['request_ids'] = {
+                            sql: request_id for sql, request_id in st.session_state['request_ids'].items()
+                            if sql in st.session_state['recent_sqls']
+                        }
+                        st.session_state['request_ids'][data["sql"]] = data["request_id"]
                 except Exception as e:
                     st.error(f"Error generating SQL: {e}")
 
@@ -78,7 +95,10 @@ elif endpoint == "/execute":
             st.warning("Please enter a SQL query.")
         else:
             try:
-                resp = requests.post(f"{API_URL}/execute", json={"sql": sql})
+                body = {"sql": sql}
+                if sql in st.session_state['request_ids']:
+                    body["request_id"] = st.session_state['request_ids'][sql]
+                resp = requests.post(f"{API_URL}/execute", json=body)
                 resp.raise_for_status()
                 data = resp.json()
                 if "result" in data:
@@ -0,0 +1,274 @@
+"""
+Lightweight per-stage tracing for the request pipeline.
+
+`span(name, **attributes)` times a block of code as one span of the current
+trace; spans opened inside it (in the same task, or in a worker thread started
+with anyio.to_thread / submit_in_context) become its children. Nothing is sent
+to a collector: when the root span of a trace ends, the whole trace is handed to
+the configured exporter, which appends it to a JSONL file or logs it as a tree
+with the slowest stage marked.
+
+Spans use the OpenTelemetry field names (traceId, spanId, parentSpanId, name,
+kind, startTimeUnixNano, endTimeUnixNano, attributes, status), so a trace file
+can be converted to OTLP or loaded by tools that read it. Listeners (see
+Tracer.add_listener) are called with every finished span, exported or not; the
+metrics registry uses this for its latency histograms. With no exporter and no
+listener, span() does nothing and costs next to nothing.
+"""
+import contextvars
+import functools
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_span_id", "name", "attributes", "start_ns", "end_ns",
+                 "status", "status_message")
+
+    def __init__(self, name: str, trace_id: str, parent_span_id: str = None, attributes: dict = None):
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_span_id = parent_span_id
+        self.name = name
+        self.attributes = dict(attributes or {})
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.status = "STATUS_CODE_UNSET"
+        self.status_message = None
+
+    def set_attribute(self, key: str, value) -> None:
+        self.attributes[key] = value
+
+    @property
+    def duration(self) -> float:
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e9
+
+    def to_dict(self, service_name: str) -> dict:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_span_id or "",
+            "name": self.name,
+            "kind": "SPAN_KIND_INTERNAL",
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [{"key": key, "value": _attribute_value(value)} for key, value in self.attributes.items()],
+            "status": {"code": self.status},
+            "resource": {"service.name": service_name},
+        }
+        if self.status_message:
+            span["status"]["message"] = self.status_message
+        return span
+
+
+class _NoSpan:
+    """
+    Returned by span() while tracing is off, so callers can set attributes unconditionally.
+    """
+    def set_attribute(self, key: str, value) -> None:
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+def _attribute_value(value) -> dict:
+    # OTLP JSON encoding of an attribute value.
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class FileExporter:
+    """
+    Appends every span of a finished trace to a JSONL file, one span per line.
+    """
+    def __init__(self, path: str = "traces.jsonl"):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, spans: list, service_name: str) -> None:
+        lines = "".join(json.dumps(span.to_dict(service_name)) + "\n" for span in spans)
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(lines)
+
+
+class ConsoleExporter:
+    """
+    Logs a finished trace as an indented tree of spans with their durations,
+    marking the slowest child of each span.
+    """
+    def export(self, spans: list, service_name: str) -> None:
+        children = {}
+        for span in spans:
+            children.setdefault(span.parent_span_id, []).append(span)
+        for siblings in children.values():
+            siblings.sort(key=lambda span: span.start_ns)
+        lines = []
+
+        def walk(span, depth, dominant):
+            marker = "  <- slowest" if dominant else ""
+            lines.append(f"{'  ' * depth}{span.name} {span.duration * 1000:.1f} ms{marker}")
+            kids = children.get(span.span_id, [])
+            slowest = max(kids, key=lambda kid: kid.duration) if len(kids) > 1 else None
+            for kid in kids:
+                walk(kid, depth + 1, kid is slowest)
+
+        for root in children.get(None, []):
+            walk(root, 0, False)
+        logging.info(f"Trace {spans[0].trace_id}:\n" + "\n".join(lines))
+
+
+class Tracer:
+    """
+    Collects the spans of each trace until its root span ends, then exports them.
+    """
+    def __init__(self, exporter=None, service_name: str = "vanna-mcp-server"):
+        self.exporter = exporter
+        self.service_name = service_name
+        self.listeners = []
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.exporter is not None or bool(self.listeners)
+
+    def add_listener(self, listener) -> None:
+        """
+        Calls `listener(span)` for every span that ends, on the thread that ended it.
+        """
+        if listener not in self.listeners:
+            self.listeners.append(listener)
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        if self.exporter is None and not self.listeners:
+            yield _NO_SPAN
+            return
+        parent = _current_span.get()
+        span = Span(name, parent.trace_id if parent else secrets.token_hex(16),
+                    parent.span_id if parent else None, attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.status = "STATUS_CODE_ERROR"
+            span.status_message = f"{type(e).__name__}: {e}"
+            span.attributes.setdefault("error.type", type(e).__name__)
+            raise
+        finally:
+            _current_span.reset(token)
+            span.end_ns = time.time_ns()
+            if span.status == "STATUS_CODE_UNSET" and span.attributes.get("error"):
+                span.status = "STATUS_CODE_ERROR"
+            for listener in self.listeners:
+                try:
+                    listener(span)
+                except Exception as e:
+                    logging.warning(f"Span listener failed: {e}")
+            if self.exporter is not None:
+                self._finish(span)
+
+    def _finish(self, span: Span) -> None:
+        with self._lock:
+            spans = self._pending.setdefault(span.trace_id, [])
+            spans.append(span)
+            if span.parent_span_id is not None:
+                return
+            del self._pending[span.trace_id]
+        _mark_dominant_stage(span, spans)
+        try:
+            self.exporter.export(spans, self.service_name)
+        except Exception as e:
+            logging.warning(f"Could not export trace {span.trace_id}: {e}")
+
+
+def _mark_dominant_stage(root: Span, spans: list) -> None:
+    stages = [span for span in spans if span.parent_span_id == root.span_id]
+    if stages:
+        slowest = max(stages, key=lambda span: span.duration)
+        root.set_attribute("trace.dominant_stage", slowest.name)
+        root.set_attribute("trace.dominant_stage_share", round(slowest.duration / root.duration, 3)
+                           if root.duration else 1.0)
+
+
+tracer = Tracer()
+
+
+def span(name: str, **attributes):
+    """
+    Context manager timing a block as a span of the current trace (see module docstring).
+    """
+    return tracer.span(name, **attributes)
+
+
+def current_span():
+    """
+    The innermost open span, for adding attributes; a no-op stand-in when there is none.
+    """
+    return _current_span.get() or _NO_SPAN
+
+
+def record_exception(e: BaseException) -> None:
+    """
+    Marks the current span as failed with `e`, for errors that are caught and
+    turned into a return value rather than raised.
+    """
+    current = current_span()
+    current.set_attribute("error", str(e))
+    current.set_attribute("error.type", type(e).__name__)
+
+
+def traced(name: str):
+    """
+    Decorator running an async function (an MCP tool) inside a span of its own,
+    which is the root of the request's trace. The span carries the tool name as
+    its "mcp.tool" attribute.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            with span(name, **{"mcp.tool": name}):
+                return await fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def submit_in_context(executor, fn, *args):
+    """
+    executor.submit that runs `fn` in a copy of the caller's context, so spans it
+    opens stay inside the caller's trace.
+    """
+    return executor.submit(contextvars.copy_context().run, fn, *args)
+
+
+def configure(exporter: str = None, path: str = None) -> None:
+    """
+    Selects the exporter: "file" (JSONL at `path`, traces.jsonl by default),
+    "console" (logged trace trees) or "none"/empty to turn tracing off.
+    """
+    exporter = (exporter or "none").strip().lower()
+    if exporter == "file":
+        tracer.exporter = FileExporter(path or "traces.jsonl")
+    elif exporter == "console":
+        tracer.exporter = ConsoleExporter()
+    elif exporter in ("none", "off", "0", ""):
+        tracer.exporter = None
+    else:
+        raise ValueError(f"Unknown trace exporter {exporter!r}; expected file, console or none")
+    if exporter == "file":
+        logging.info(f"Tracing enabled; traces are appended to {os.path.abspath(tracer.exporter.path)}")
+    elif exporter == "console":
+        logging.info("Tracing enabled; traces are logged")
@@ -1,8 +1,10 @@
 # train.py
+import argparse
 import os
 import logging
+import sys
 from dotenv import load_dotenv
-from app import MyVanna
+from training_sync import TrainingManifest, apply_sync, desired_items, plan_is_empty, plan_sync
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -156,10 +158,8 @@ Columns:
 - `account`: The account of the transaction partner."""}
 ]
 
-training_data = [
-    # =================================================================
-    # Simple Queries
-    # =================================================================
+# Question-SQL pairs by difficulty; bench_pipeline.py draws its workload mix from these.
+simple_training_data = [
     {
         "question": "How many total clients does the bank have?",
         "sql": "SELECT COUNT(client_id) FROM client;"
@@ -220,10 +220,9 @@ training_data = [
         "question": "What are the different regions listed in the district table?",
         "sql": "SELECT DISTINCT A3 FROM district;"
     },
+]
 
-    # =================================================================
-    # Moderate Queries
-    # =================================================================
+moderate_training_data = [
     {
         "question": "How many 'gold' credit cards are held by female clients?",
         "sql": """
@@ -340,10 +339,9 @@ WHERE k_symbol = 'SIPO'
   AND amount > (SELECT AVG(amount) FROM `order` WHERE k_symbol = 'SIPO');
 """
     },
+]
 
-    # =================================================================
-    # Hard Queries
-    # =================================================================
+hard_training_data = [
     {
         "question": "For each district, find the client who made the single largest transaction and show that transaction amount.",
         "sql": """
@@ -616,36 +614,82 @@ WHERE
     }
 ]
 
-def train_vanna(vn):
+training_data = simple_training_data + moderate_training_data + hard_training_data
+
+def store_id(config: dict) -> str:
+    """
+    Identifies the vector store the training manifest belongs to.
+    """
+    if config.get("vector_store", "weaviate") == "local":
+        return f"local:{os.path.abspath(config.get('local_vector_path', 'vector_store.npz'))}"
+    return f"weaviate:{config.get('weaviate_url')}"
+
+
+def sync_vanna(config: dict, manifest_path: str = ".training_manifest.json", batch_size: int = 256,
+               concurrency: int = 2, reset: bool = False):
     """
-    Trains the Vanna instance with DDL, documentation, and question-SQL pairs.
+    Brings the vector store in line with the training data above, touching only
+    items that were added, edited or removed since the last sync. With `reset`,
+    the training collections are emptied first and everything is re-ingested
+    (needed once for a store trained before manifests existed). Without a
+    manifest for this store, a store that already holds training data is left
+    alone and RuntimeError is raised, since every item would be ingested twice.
     """
-    logging.info("--- Training on DDL statements ---")
-    for item in ddl_statements:
-        vn.train(ddl=item["description"])
-    logging.info("DDL training complete.")
+    desired = desired_items(
+        ddl=[item["description"] for item in ddl_statements],
+        documentation=[item["description"] for item in documentation_entries],
+        question_sql=training_data,
+    )
+    manifest = TrainingManifest(manifest_path, store_id(config))
+    ingested = {"ddl": {}, "doc": {}, "sql": {}} if reset else manifest.load()
+    plan = plan_sync(desired, ingested)
+    if plan_is_empty(plan) and not reset:
+        logging.info(f"Training data is up to date ({plan['unchanged']} items); nothing to do.")
+        return {"added": 0, "removed": 0, "unchanged": plan["unchanged"]}
+    logging.info(
+        f"Sync plan: {sum(len(h) for h in plan['add'].values())} to add, "
+        f"{sum(len(h) for h in plan['remove'].values())} to remove, {plan['unchanged']} unchanged"
+    )
+    # Imported here so that a no-op sync does not pay for loading the engine.
+    from vanna_engine import create_vanna
 
-    logging.info("--- Training on Documentation ---")
-    for item in documentation_entries:
-        vn.train(documentation=item["description"])
-    logging.info("Documentation training complete.")
+    logging.info("Initializing Vanna for training...")
+    with create_vanna(config) as vn:
+        if reset:
+            logging.info("Clearing the training collections...")
+            vn.clear_training_data()
+        elif not any(ingested.values()) and any(vn._collection_properties(key) for key in ingested):
+            raise RuntimeError(
+                f"The vector store already holds training data but {manifest_path} has no record of it for "
+                f"{manifest.store}; run with --reset to re-ingest everything instead of duplicating it."
+            )
+        return apply_sync(vn, plan, desired, ingested, manifest, batch_size=batch_size, concurrency=concurrency)
 
-    logging.info("--- Training on Question-SQL pairs ---")
-    for pair in training_data:
-        ingested_id = vn.train(question=pair["question"], sql=pair["sql"])
-        logging.info(f"  - Ingested Q: '{pair['question']}' | Received ID: {ingested_id}")
-    logging.info("Question-SQL training complete.")
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Sync the Vanna vector store with the training data in this file.")
+    parser.add_argument("--reset", action="store_true", help="empty the training collections and re-ingest everything")
+    args = parser.parse_args()
+
     load_dotenv()
     
     config = {
         "weaviate_url": os.getenv("WEAVIATE_URL"),
         "weaviate_api_key": os.getenv("WEAVIATE_API_KEY"),
+        "vector_store": os.getenv("VECTOR_STORE", "weaviate"),
+        "local_vector_path": os.getenv("LOCAL_VECTOR_PATH", "vector_store.npz"),
     }
 
-    logging.info("Initializing Vanna for training...")
-    with MyVanna(config=config) as vn:
-        logging.info("Starting training process...")
-        train_vanna(vn)
-        logging.info("✅ Vanna model training finished successfully.")
\ No newline at end of file
+    logging.info("Starting training sync...")
+    try:
+        sync_vanna(
+            config,
+            manifest_path=os.getenv("TRAINING_MANIFEST", ".training_manifest.json"),
+            batch_size=int(os.getenv("TRAIN_BATCH_SIZE", "256")),
+            concurrency=int(os.getenv("TRAIN_CONCURRENCY", "2")),
+            reset=args.reset,
+        )
+    except RuntimeError as e:
+        logging.error(str(e))
+        sys.exit(1)
+    logging.info("✅ Vanna model training finished successfully.")
@@ -0,0 +1,130 @@
+"""
+Incremental training: only what changed in the training data reaches the vector store.
+
+Every training item is fingerprinted by a hash of its content and stored under a
+UUID derived from that hash. A local manifest records the hashes ingested into a
+given vector store. Syncing compares the manifest with the current training data
+and adds only new items, deletes removed ones, and re-embeds only edited ones (an
+edit is a new hash plus a removed hash). When nothing changed the plan is empty
+and neither the vector store nor the embedding model is touched.
+"""
+import hashlib
+import json
+import logging
+import os
+import time
+import uuid
+
+# Namespace for the UUIDs derived from item hashes.
+TRAINING_NAMESPACE = uuid.UUID("6b1c3f5e-8a57-4d1e-9d7b-3f0e2a1c5b90")
+
+
+def item_hash(cluster_key: str, data_object: dict) -> str:
+    payload = json.dumps({"cluster": cluster_key, **data_object}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def item_id(hash: str) -> str:
+    return str(uuid.uuid5(TRAINING_NAMESPACE, hash))
+
+
+def desired_items(ddl: list = None, documentation: list = None, question_sql: list = None) -> dict:
+    """
+    Maps "ddl"/"doc"/"sql" to {hash: data object} for the given training data.
+    Duplicate items collapse into one.
+    """
+    items = {
+        "ddl": [{"description": text} for text in ddl or []],
+        "doc": [{"description": text} for text in documentation or []],
+        "sql": [{"sql": pair["sql"], "natural_language_question": pair["question"]} for pair in question_sql or []],
+    }
+    return {key: {item_hash(key, data_object): data_object for data_object in objects} for key, objects in items.items()}
+
+
+class TrainingManifest:
+    """
+    Sidecar JSON file of the item hashes ingested into one vector store. `store`
+    identifies that store (e.g. the Weaviate URL or the snapshot path); a
+    manifest written for a different store is ignored.
+    """
+    def __init__(self, path: str, store: str):
+        self.path = path
+        self.store = store
+
+    def load(self) -> dict:
+        if not os.path.exists(self.path):
+            return {"ddl": {}, "doc": {}, "sql": {}}
+        with open(self.path, encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("store") != self.store:
+            logging.warning(
+                f"Training manifest {self.path} was written for {manifest.get('store')!r}, not {self.store!r}; ignoring it"
+            )
+            return {"ddl": {}, "doc": {}, "sql": {}}
+        return {key: dict(manifest.get("items", {}).get(key, {})) for key in ("ddl", "doc", "sql")}
+
+    def save(self, items: dict) -> None:
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"store": self.store, "items": items}, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+
+def plan_sync(desired: dict, ingested: dict) -> dict:
+    """
+    Compares the desired items with the ingested ones ({key: {hash: id}}) and
+    returns the hashes to add and the {hash: id} to remove, per collection.
+    """
+    plan = {"add": {}, "remove": {}, "unchanged": 0}
+    for key in ("ddl", "doc", "sql"):
+        wanted, present = desired.get(key, {}), ingested.get(key, {})
+        plan["add"][key] = [hash for hash in wanted if hash not in present]
+        plan["remove"][key] = {hash: id for hash, id in present.items() if hash not in wanted}
+        plan["unchanged"] += sum(1 for hash in wanted if hash in present)
+    return plan
+
+
+def plan_is_empty(plan: dict) -> bool:
+    return not any(plan["add"].values()) and not any(plan["remove"].values())
+
+
+def apply_sync(vn, plan: dict, desired: dict, ingested: dict, manifest: TrainingManifest,
+               batch_size: int = 256, concurrency: int = 2) -> dict:
+    """
+    Deletes the removed items, embeds and inserts the added ones, and writes the
+    updated manifest. Items that fail to insert stay out of the manifest so the
+    next sync retries them.
+    """
+    start = time.time()
+    removed = {key: list(entries.values()) for key, entries in plan["remove"].items() if entries}
+    deleted = vn.remove_training_data_bulk(removed) if removed else 0
+    for key, entries in plan["remove"].items():
+        for hash in entries:
+            ingested[key].pop(hash, None)
+
+    added = 0
+    if any(plan["add"].values()):
+        ids = {key: [item_id(hash) for hash in hashes] for key, hashes in plan["add"].items()}
+        stats = vn.train_bulk(
+            ddl=[desired["ddl"][hash]["description"] for hash in plan["add"]["ddl"]],
+            documentation=[desired["doc"][hash]["description"] for hash in plan["add"]["doc"]],
+            question_sql=[
+                {"question": desired["sql"][hash]["natural_language_question"], "sql": desired["sql"][hash]["sql"]}
+                for hash in plan["add"]["sql"]
+            ],
+            batch_size=batch_size,
+            concurrency=concurrency,
+            ids=ids,
+        )
+        for key, hashes in plan["add"].items():
+            stored = {id[:-len(key) - 1] for id in stats["ids"].get(key, [])}
+            for hash in hashes:
+                if item_id(hash) in stored:
+                    ingested[key][hash] = item_id(hash)
+                    added += 1
+    manifest.save(ingested)
+    result = {"added": added, "removed": deleted, "unchanged": plan["unchanged"], "seconds": time.time() - start}
+    logging.info(
+        f"Training sync: {added} added, {deleted} removed, {plan['unchanged']} unchanged in {result['seconds']:.2f}s"
+    )
+    return result
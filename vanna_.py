@@ -1,6 +1,5 @@
 import os
 import json
-from tkinter import X
 import weaviate
 from vanna.weaviate.weaviate_vector import WeaviateDatabase
 from vanna.base import VannaBase
@@ -9,11 +8,8 @@ from dotenv import load_dotenv
 from langchain_openai import AzureChatOpenAI
 from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
 
-from flask import Flask, request, jsonify
-app = Flask(__name__)
-
-
-import pandas as pd  # Added for Excel writing
+from eval_runner import checkpoint_inputs, run_eval, vanna_predictor, write_debug_excel
+from caches import TrainingVersion
 
 load_dotenv()
 
@@ -694,6 +690,12 @@ class MyVanna(WeaviateDatabase, LangChainAzureChat):
         print("\nWeaviate connection closed successfully.")
 
 if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--resume", action="store_true",
+                        help="continue predict_dev.checkpoint.jsonl instead of predicting every question again")
+    args = parser.parse_args()
 
     config = {
         "weaviate_url": os.getenv("WEAVIATE_URL"),
@@ -704,6 +706,8 @@ if __name__ == '__main__':
         vn.connect_to_sqlite('financial.sqlite')
 
         train_vanna(vn)
+        # Let the engine's caches and the evaluation checkpoint see the retrain.
+        TrainingVersion(".training_version").bump()
 
         # with open('dev.json', 'r') as f:
         #     dev_data = json.load(f)
@@ -754,44 +758,34 @@ if __name__ == '__main__':
         questions_df = pd.DataFrame(questions)
         questions_df.to_excel('questions.xlsx', index=False)
 
-        predictions = {}
-        debug_rows = []  # For storing prompt and SQL for Excel
-
-        for idx, item in enumerate(dev_data):
-            question = item.get('question', '')
-            db_id = item.get('db_id', '')
-            try:
-                # Generate the SQL prompt
-                prompt = vn.get_sql_prompt(
-                    initial_prompt=vn.config.get("initial_prompt", None) if hasattr(vn, "config") else None,
-                    question=question,
-                    question_sql_list=vn.get_similar_question_sql(question),
-                    ddl_list=vn.get_related_ddl(question),
-                    doc_list=vn.get_related_documentation(question),
-                )
-                # print(f"\n[SQL PROMPT for idx {idx}]:\n{prompt}\n")
-                sql_query = vn.generate_sql(question=question, allow_llm_to_see_data=True)
-            except Exception as e:
-                prompt = f"Error: {str(e)}"
-                sql_query = f"Error: {str(e)}"
-
-            predictions[str(idx)] = f"{sql_query}\t----- bird -----\t{db_id}"
-            # print(f"[{idx}] {question}\nSQL: {sql_query}\n")
-
-            debug_rows.append({
-                "idx": idx,
-                "question": question,
-                "db_id": db_id,
-                "sql_prompt": prompt,
-                "sql_query": sql_query
-            })
-
-        with open('predict_dev.json', 'w') as f:
-            json.dump(predictions, f, indent=2)
+    # Predictions come from the server's engine (vanna_engine): one retrieval per
+    # question, and the prompt logged is the one that produced the SQL. This run
+    # lets the model see intermediate_sql results, as
+    # `eval_runner.py --allow-llm-to-see-data` does.
+    from vanna_engine import create_vanna
+
+    concurrency = int(os.getenv("EVAL_CONCURRENCY", "8"))
+    engine_config = {**config, "retrieval_workers": 3 * concurrency}
+    with create_vanna(engine_config) as engine:
+        engine.connect_to_sqlite_pool('financial.sqlite')
+        predict = vanna_predictor(engine, allow_llm_to_see_data=True)
+
+        # Questions run concurrently and every answer is checkpointed. The run
+        # above retrains first, so the checkpoint is only continued with
+        # --resume, and only if it was written for the same inputs.
+        records = run_eval(
+            dev_data,
+            predict,
+            checkpoint_path='predict_dev.checkpoint.jsonl',
+            output_path='predict_dev.json',
+            concurrency=concurrency,
+            inputs=checkpoint_inputs('dev.json', 'financial.sqlite', engine.training_version.current(),
+                                     allow_llm_to_see_data=True),
+            resume=args.resume,
+        )
 
         # Save the debug info to Excel
-        debug_df = pd.DataFrame(debug_rows)
-        debug_df.to_excel("vanna_sql_prompt_debug.xlsx", index=False)
+        write_debug_excel(records, "vanna_sql_prompt_debug.xlsx")
 
         print("\nAll predictions saved to predict_dev.json\n")
         print("SQL prompts and queries saved to vanna_sql_prompt_debug.xlsx\n")
@@ -0,0 +1,595 @@
+"""
+The Vanna engine behind the MCP server: the Azure OpenAI chat model, the shared
+retrieval/caching pipeline and its two vector store backends.
+
+app.py imports this module inside app_lifespan, so the heavy client libraries
+(weaviate, langchain, fastembed) are loaded when the server starts serving
+rather than when app.py is imported.
+"""
+import os
+import logging
+import weaviate
+from weaviate.classes.query import Filter, MetadataQuery
+from vanna.weaviate.weaviate_vector import WeaviateDatabase
+from vanna.base import VannaBase
+from langchain_openai import AzureChatOpenAI
+from langchain_core.messages import SystemMessage, HumanMessage, AIMessage, AIMessageChunk
+from concurrent.futures import ThreadPoolExecutor
+import time
+
+import anyio
+
+from caches import AnswerCache, EmbeddingCache, TrainingVersion
+from local_vector import LocalVectorStore
+from prompt_budget import PromptBudget, count_tokens
+from schema_index import SchemaIndex
+from sqlite_pool import SQLiteReadPool
+from tracing import span, submit_in_context
+
+
+class LangChainAzureChat(VannaBase):
+    def __init__(self, config=None):
+        super().__init__(config=config)
+        self.llm = self._create_llm()
+        # Caps in-flight async LLM calls; created on first use inside the event loop.
+        self.llm_max_concurrency = (config or {}).get("llm_max_concurrency", 100)
+        # Off by default: stream usage is sent through `stream_options`, which the
+        # pinned api_version does not accept (it needs 2024-09-01-preview or later).
+        self.llm_stream_usage = (config or {}).get("llm_stream_usage", False)
+        self._llm_semaphore = None
+
+    def _create_llm(self):
+        return AzureChatOpenAI(
+            azure_deployment="gpt-4.1",
+            api_version="2024-02-15-preview",
+            temperature=0.0,
+            max_tokens=1000,
+            api_key=os.getenv("OPENAI_API_KEY"),
+            azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+        )
+
+    def system_message(self, message: str) -> SystemMessage:
+        return SystemMessage(content=message)
+
+    def user_message(self, message: str) -> HumanMessage:
+        return HumanMessage(content=message)
+
+    def assistant_message(self, message: str) -> AIMessage:
+        return AIMessage(content=message)
+
+    def submit_prompt(self, prompt, **kwargs) -> str:
+        with span("llm") as llm_span:
+            response = self.llm.invoke(prompt)
+            content, input_tokens, output_tokens = self._parse_response(response)
+            llm_span.set_attribute("llm.input_tokens", input_tokens or 0)
+            llm_span.set_attribute("llm.output_tokens", output_tokens or 0)
+        return content, input_tokens, output_tokens
+
+    async def asubmit_prompt(self, prompt, **kwargs):
+        """
+        Async counterpart of submit_prompt built on `ainvoke`. Waiting on the LLM
+        does not hold a worker thread; at most `llm_max_concurrency` calls are in
+        flight at once.
+        """
+        if self._llm_semaphore is None:
+            self._llm_semaphore = anyio.Semaphore(self.llm_max_concurrency)
+        with span("llm") as llm_span:
+            queued = time.time()
+            async with self._llm_semaphore:
+                llm_span.set_attribute("llm.queue_seconds", time.time() - queued)
+                response = await self.llm.ainvoke(prompt)
+            content, input_tokens, output_tokens = self._parse_response(response)
+            llm_span.set_attribute("llm.input_tokens", input_tokens or 0)
+            llm_span.set_attribute("llm.output_tokens", output_tokens or 0)
+        return content, input_tokens, output_tokens
+
+    async def astream_prompt(self, prompt, **kwargs):
+        """
+        Streams the completion for a prompt as AIMessageChunk objects. Token usage
+        arrives on the final chunk: from the API when `llm_stream_usage` is enabled,
+        otherwise counted locally with the prompt budget's tokenizer once the
+        stream ends. Shares the concurrency limit of asubmit_prompt.
+        """
+        if self._llm_semaphore is None:
+            self._llm_semaphore = anyio.Semaphore(self.llm_max_concurrency)
+        completion, has_usage = [], False
+        async with self._llm_semaphore:
+            async for chunk in self.llm.astream(prompt, stream_usage=self.llm_stream_usage):
+                has_usage = has_usage or bool(chunk.usage_metadata)
+                if isinstance(chunk.content, str):
+                    completion.append(chunk.content)
+                yield chunk
+        if not has_usage:
+            yield AIMessageChunk(content="", usage_metadata=self.count_usage(prompt, "".join(completion)))
+
+    def count_usage(self, prompt, completion: str) -> dict:
+        """
+        Estimates the usage metadata of a call from its messages and completion
+        text. Per-message overhead tokens are not counted.
+        """
+        encoding = self.config.get("prompt_token_encoding", "o200k_base")
+        input_tokens = sum(count_tokens(message.content, encoding) for message in prompt)
+        output_tokens = count_tokens(completion, encoding)
+        return {"input_tokens": input_tokens, "output_tokens": output_tokens,
+                "total_tokens": input_tokens + output_tokens}
+
+    def log(self, message: str, title: str = "Info"):
+        # VannaBase prints to stdout, which is the MCP stdio transport.
+        logging.debug(f"{title}: {message}")
+
+    def _parse_response(self, response):
+        logging.info(f"Response: {response}")
+        input_tokens = response.usage_metadata.get('input_tokens')
+        output_tokens = response.usage_metadata.get('output_tokens')
+        return response.content, input_tokens, output_tokens
+
+class VannaPipeline:
+    """
+    Retrieval, caching and prompt assembly shared by the vector store backends.
+    Mixed in ahead of the vector store class, which provides `embeddings`,
+    `_query_collection` and the training data methods.
+    """
+    def _init_pipeline(self):
+        # The three retrieval lookups of a question run side by side on this pool.
+        # It is shared by all requests, so it needs three threads per concurrent
+        # request: by default, one per lookup for each of anyio's 40 worker
+        # threads. Threads are only started as they are needed.
+        self.retrieval_pool = ThreadPoolExecutor(
+            max_workers=self.config.get("retrieval_workers", 3 * 40),
+            thread_name_prefix="vanna-retrieval",
+        )
+        self.sqlite_pool = None
+        self.schema_index = None
+        self.prompt_budget = PromptBudget(
+            max_tokens=self.config.get("prompt_token_budget", 4000),
+            encoding=self.config.get("prompt_token_encoding", "o200k_base"),
+        )
+        self.embedding_cache = EmbeddingCache(max_size=self.config.get("embedding_cache_size", 1024))
+        self.answer_cache = AnswerCache(
+            max_size=self.config.get("answer_cache_size", 512),
+            ttl=self.config.get("answer_cache_ttl", 3600),
+            similarity_threshold=self.config.get("answer_cache_similarity", 0.95),
+        )
+        # Bumped whenever training data changes, here or in train_vanna.py.
+        self.training_version = TrainingVersion(self.config.get("training_version_file", ".training_version"))
+
+    def generate_embedding(self, data: str, **kwargs):
+        # WeaviateDatabase loads a fresh fastembed model on every call; reuse the
+        # one the vector store created in __init__ instead.
+        embedding = next(self.embeddings.embed(data))
+        return embedding.tolist()
+
+    def generate_embeddings(self, texts: list, batch_size: int = 256) -> list:
+        """
+        Embeds many texts in batches of `batch_size` with the shared fastembed
+        model. With config `embedding_parallel`, batches are spread over that many
+        worker processes.
+        """
+        parallel = self.config.get("embedding_parallel")
+        return [embedding.tolist() for embedding in self.embeddings.embed(texts, batch_size=batch_size, parallel=parallel)]
+
+    def embed_question(self, question: str):
+        """
+        Returns the embedding of a question, served from the LRU cache when the
+        same (normalized) question has been embedded before.
+        """
+        embedding, _, _ = self.lookup_embedding(question)
+        return embedding
+
+    def lookup_embedding(self, question: str):
+        """
+        Like embed_question, but also reports whether the embedding came from the
+        cache and how many seconds the lookup took.
+        """
+        start = time.time()
+        with span("embedding") as embedding_span:
+            embedding = self.embedding_cache.get(question)
+            cached = embedding is not None
+            if embedding is None:
+                embedding = self.generate_embedding(question)
+                self.embedding_cache.put(question, embedding)
+            embedding_span.set_attribute("embedding.cached", cached)
+        return embedding, cached, time.time() - start
+
+    @staticmethod
+    def _score(item: dict):
+        # Both vector stores report cosine distance; turn it into a similarity, higher is better.
+        distance = item.get("_distance")
+        return None if distance is None else 1.0 - distance
+
+    def get_related_ddl_with_scores(self, question: str, embedding=None, **kwargs) -> list:
+        if self.schema_index is not None:
+            # Local graph walk over the live schema; fall back to vector search
+            # when the question names no table.
+            related = self.schema_index.related_ddl(question)
+            if related:
+                return related
+        vector_input = embedding if embedding is not None else self.embed_question(question)
+        response_list = self._query_collection('ddl', vector_input, ["description"])
+        return [(item["description"], self._score(item)) for item in response_list]
+
+    def get_related_documentation_with_scores(self, question: str, embedding=None, **kwargs) -> list:
+        vector_input = embedding if embedding is not None else self.embed_question(question)
+        response_list = self._query_collection('doc', vector_input, ["description"])
+        return [(item["description"], self._score(item)) for item in response_list]
+
+    def get_similar_question_sql_with_scores(self, question: str, embedding=None, **kwargs) -> list:
+        vector_input = embedding if embedding is not None else self.embed_question(question)
+        response_list = self._query_collection('sql', vector_input, ["sql", "natural_language_question"])
+        return [({"question": item["natural_language_question"], "sql": item["sql"]}, self._score(item))
+                for item in response_list]
+
+    def get_related_ddl(self, question: str, embedding=None, **kwargs) -> list:
+        return [ddl for ddl, _ in self.get_related_ddl_with_scores(question, embedding=embedding)]
+
+    def get_related_documentation(self, question: str, embedding=None, **kwargs) -> list:
+        return [doc for doc, _ in self.get_related_documentation_with_scores(question, embedding=embedding)]
+
+    def get_similar_question_sql(self, question: str, embedding=None, **kwargs) -> list:
+        return [pair for pair, _ in self.get_similar_question_sql_with_scores(question, embedding=embedding)]
+
+    def retrieve_context(self, question: str, embedding=None):
+        """
+        Embeds the question once (unless `embedding` is given) and runs the similar
+        question/SQL, DDL and documentation lookups concurrently with that vector.
+        Returns the results keyed by "sql", "ddl" and "doc" (plus their retrieval
+        scores under "scored", "embedding" and "embedding_cached"), and the seconds
+        each stage took.
+        """
+        if embedding is None:
+            embedding, embedding_cached, embedding_time = self.lookup_embedding(question)
+        else:
+            embedding_cached, embedding_time = None, 0.0
+
+        lookups = {
+            "sql": self.get_similar_question_sql_with_scores,
+            "ddl": self.get_related_ddl_with_scores,
+            "doc": self.get_related_documentation_with_scores,
+        }
+
+        def timed(key, lookup):
+            start = time.time()
+            with span(f"retrieval.{key}") as lookup_span:
+                result = lookup(question, embedding=embedding)
+                lookup_span.set_attribute("retrieval.results", len(result))
+            return result, time.time() - start
+
+        context = {"embedding": embedding, "embedding_cached": embedding_cached, "scored": {}}
+        timings = {"embedding": embedding_time}
+        with span("retrieval"):
+            futures = {
+                key: submit_in_context(self.retrieval_pool, timed, key, lookup) for key, lookup in lookups.items()
+            }
+            for key, future in futures.items():
+                context["scored"][key], timings[key] = future.result()
+                context[key] = [item for item, _ in context["scored"][key]]
+        return context, timings
+
+    def build_budgeted_sql_prompt(self, question: str, context: dict):
+        """
+        Builds the SQL prompt from retrieved context, keeping only what fits in the
+        prompt token budget (highest retrieval scores first). Returns the prompt and
+        the per-section report of kept and dropped tokens.
+        """
+        initial_prompt = self.config.get("initial_prompt", None)
+        bare_prompt = self.get_sql_prompt(
+            initial_prompt=initial_prompt, question=question, question_sql_list=[], ddl_list=[], doc_list=[]
+        )
+        fixed_tokens = sum(self.prompt_budget.count(message.content) for message in bare_prompt)
+        selected, report = self.prompt_budget.fit(fixed_tokens, context["scored"])
+        prompt = self.get_sql_prompt(
+            initial_prompt=initial_prompt,
+            question=question,
+            question_sql_list=selected["sql"],
+            ddl_list=selected["ddl"],
+            doc_list=selected["doc"]
+        )
+        return prompt, report
+
+    def prepare_sql_prompt(self, question: str, embedding=None) -> dict:
+        """
+        Runs retrieval once and builds the token-budgeted prompt from it. Returns the
+        prompt, the retrieved context, the per-section budget report under
+        "context_tokens" and the seconds each stage took under "timings"
+        ("embedding", "sql", "ddl", "doc", "retrieval" and "prompt").
+        """
+        retrieval_start = time.time()
+        context, timings = self.retrieve_context(question, embedding=embedding)
+        timings["retrieval"] = time.time() - retrieval_start
+        logging.info(
+            f"Retrieval took {timings['retrieval']:.3f}s "
+            f"(sql {timings['sql']:.3f}s, ddl {timings['ddl']:.3f}s, doc {timings['doc']:.3f}s)"
+        )
+        prompt_start = time.time()
+        with span("prompt") as prompt_span:
+            prompt, report = self.build_budgeted_sql_prompt(question, context)
+            prompt_span.set_attribute("prompt.context_tokens", sum(stats["kept_tokens"] for stats in report.values()))
+        timings["prompt"] = time.time() - prompt_start
+        logging.info(f"Prompt: {prompt}")
+        logging.info(
+            "Prompt context tokens kept/dropped: " + ", ".join(
+                f"{section} {stats['kept_tokens']}/{stats['dropped_tokens']}" for section, stats in report.items()
+            )
+        )
+        return {"prompt": prompt, "context": context, "context_tokens": report, "timings": timings}
+
+    def _generation_result(self, prepared: dict, llm_response: str, input_tokens, output_tokens,
+                           llm_time: float) -> dict:
+        prepared["timings"]["llm"] = llm_time
+        return {
+            **prepared,
+            "llm_response": llm_response,
+            "sql": self.extract_sql(llm_response) if llm_response else llm_response,
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+        }
+
+    def generate_sql_with_prompt(self, question: str, embedding=None, allow_llm_to_see_data: bool = False) -> dict:
+        """
+        Single-pass SQL generation: one retrieval, one prompt, one LLM call.
+        Returns what prepare_sql_prompt returns plus the raw "llm_response", the
+        extracted "sql", "input_tokens", "output_tokens" and timings["llm"].
+        Unlike VannaBase.generate_sql, the prompt that produced the SQL comes back
+        with it, so callers need not rebuild it (and repeat retrieval) to log it.
+
+        With `allow_llm_to_see_data`, an answer asking for an intermediate_sql query
+        gets the same follow-up as in VannaBase.generate_sql: the query is run and
+        the model asked again with its result added to the documentation (ranked
+        first, so the budget keeps it). The second prompt is the one returned, and
+        the token counts and LLM time cover both calls.
+        """
+        prepared = self.prepare_sql_prompt(question, embedding=embedding)
+        llm_start = time.time()
+        llm_response, input_tokens, output_tokens = self.submit_prompt(prepared["prompt"])
+        if allow_llm_to_see_data and llm_response and "intermediate_sql" in llm_response:
+            intermediate_sql = self.extract_sql(llm_response)
+            df = self.run_sql(intermediate_sql)
+            intermediate_doc = (
+                f"The following is a pandas DataFrame with the results of the intermediate SQL query "
+                f"{intermediate_sql}: \n" + df.to_markdown()
+            )
+            context = prepared["context"]
+            context["scored"]["doc"] = [(intermediate_doc, float("inf"))] + context["scored"]["doc"]
+            context["doc"] = [intermediate_doc] + context["doc"]
+            prepared["prompt"], prepared["context_tokens"] = self.build_budgeted_sql_prompt(question, context)
+            llm_response, more_input_tokens, more_output_tokens = self.submit_prompt(prepared["prompt"])
+            input_tokens = (input_tokens or 0) + (more_input_tokens or 0)
+            output_tokens = (output_tokens or 0) + (more_output_tokens or 0)
+        return self._generation_result(prepared, llm_response, input_tokens, output_tokens, time.time() - llm_start)
+
+    async def agenerate_sql_with_prompt(self, question: str, embedding=None) -> dict:
+        """
+        Async generate_sql_with_prompt: retrieval and prompt building run on a
+        worker thread, the LLM call is awaited with asubmit_prompt.
+        """
+        prepared = await anyio.to_thread.run_sync(
+            lambda: self.prepare_sql_prompt(question, embedding=embedding)
+        )
+        llm_start = time.time()
+        llm_response, input_tokens, output_tokens = await self.asubmit_prompt(prepared["prompt"])
+        return self._generation_result(prepared, llm_response, input_tokens, output_tokens, time.time() - llm_start)
+
+    def get_context(self) -> dict:
+        """
+        The full schema and documentation the model can draw on, as
+        {"schema": [DDL], "documentation": [text]}. The DDL is the live catalog's
+        when the schema is indexed, the trained DDL otherwise.
+        """
+        if self.schema_index is not None:
+            schema = list(self.schema_index.ddl.values())
+        else:
+            schema = [item["description"] for item in self._collection_properties("ddl")]
+        documentation = [item["description"] for item in self._collection_properties("doc")]
+        return {"schema": schema, "documentation": documentation}
+
+    def connect_to_sqlite_pool(self, database_path: str):
+        """
+        Points run_sql at a pool of tuned, read-only per-thread SQLite connections,
+        so concurrent queries run in parallel. Pragmas come from the config keys
+        sqlite_mmap_size, sqlite_cache_size, sqlite_temp_store and sqlite_wal.
+        Unless ddl_source is "vector", also indexes the schema so DDL is selected
+        from the live catalog instead of the vector store.
+        """
+        pool_options = {
+            "mmap_size": self.config.get("sqlite_mmap_size"),
+            "cache_size": self.config.get("sqlite_cache_size"),
+            "temp_store": self.config.get("sqlite_temp_store"),
+            "enable_wal": self.config.get("sqlite_wal"),
+        }
+        self.sqlite_pool = SQLiteReadPool(
+            database_path, **{key: value for key, value in pool_options.items() if value is not None}
+        )
+        self.dialect = "SQLite"
+        self.run_sql = self.sqlite_pool.run_sql
+        self.run_sql_is_set = True
+        if self.config.get("ddl_source", "schema") == "schema":
+            conn = self.sqlite_pool.connect()
+            try:
+                self.schema_index = SchemaIndex.from_connection(conn, self.config.get("schema_synonyms"))
+            finally:
+                conn.close()
+
+    def train(self, *args, **kwargs):
+        result = super().train(*args, **kwargs)
+        self.training_version.bump()
+        return result
+
+    def train_bulk(self, ddl: list = None, documentation: list = None, question_sql: list = None,
+                   batch_size: int = 256, concurrency: int = 2, ids: dict = None) -> dict:
+        """
+        Bulk counterpart of train(). Embeds DDL statements, documentation entries
+        and {"question", "sql"} pairs in batches of `batch_size` and writes each
+        collection with the vector store's batch insert (`concurrency` parallel
+        requests where the store supports it). `ids` optionally maps "ddl"/"doc"/
+        "sql" to the ids to store the items under. Returns the new ids per
+        collection and the throughput.
+        """
+        collections = [
+            ("ddl", [{"description": text} for text in ddl or []], list(ddl or [])),
+            ("doc", [{"description": text} for text in documentation or []], list(documentation or [])),
+            ("sql", [{"sql": pair["sql"], "natural_language_question": pair["question"]} for pair in question_sql or []],
+             [pair["question"] for pair in question_sql or []]),
+        ]
+        start = time.time()
+        stored_ids, embedding_time, insert_time = {}, 0.0, 0.0
+        for cluster_key, data_objects, texts in collections:
+            if not data_objects:
+                continue
+            embed_start = time.time()
+            vectors = self.generate_embeddings(texts, batch_size=batch_size)
+            insert_start = time.time()
+            embedding_time += insert_start - embed_start
+            inserted = self._insert_many(cluster_key, data_objects, vectors, batch_size=batch_size,
+                                         concurrency=concurrency, ids=(ids or {}).get(cluster_key))
+            insert_time += time.time() - insert_start
+            stored_ids[cluster_key] = [f"{id}-{cluster_key}" for id in inserted]
+            logging.info(f"Ingested {len(inserted)}/{len(data_objects)} {cluster_key} items")
+        self.training_version.bump()
+        seconds = time.time() - start
+        items = sum(len(collection_ids) for collection_ids in stored_ids.values())
+        stats = {
+            "ids": stored_ids,
+            "items": items,
+            "seconds": seconds,
+            "items_per_sec": items / seconds if seconds else None,
+            "embedding_time": embedding_time,
+            "insert_time": insert_time,
+        }
+        logging.info(
+            f"Bulk training: {items} items in {seconds:.2f}s ({stats['items_per_sec'] or 0:.1f} items/sec; "
+            f"embedding {embedding_time:.2f}s, insert {insert_time:.2f}s)"
+        )
+        return stats
+
+    def remove_training_data_bulk(self, ids: dict) -> int:
+        """
+        Deletes many items at once; `ids` maps "ddl"/"doc"/"sql" to unsuffixed ids.
+        Returns the number deleted.
+        """
+        deleted = sum(self._delete_many(cluster_key, cluster_ids) for cluster_key, cluster_ids in ids.items() if cluster_ids)
+        self.training_version.bump()
+        return deleted
+
+    def clear_training_data(self) -> None:
+        """
+        Deletes everything in the three training collections.
+        """
+        for cluster_key in self.training_data_cluster:
+            self._clear_collection(cluster_key)
+        self.training_version.bump()
+
+    def remove_training_data(self, id: str, **kwargs) -> bool:
+        success = super().remove_training_data(id, **kwargs)
+        self.training_version.bump()
+        return success
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.retrieval_pool.shutdown(wait=False)
+        if self.sqlite_pool is not None:
+            self.sqlite_pool.close()
+
+
+class MyVanna(VannaPipeline, WeaviateDatabase, LangChainAzureChat):
+    def __init__(self, config=None):
+        self.config = config or {}
+        WeaviateDatabase.__init__(self, config=config)
+        LangChainAzureChat.__init__(self, config=config)
+        self._init_pipeline()
+
+    def _initialize_weaviate_client(self):
+        if self.config.get("weaviate_api_key"):
+            return weaviate.connect_to_weaviate_cloud(
+                cluster_url=self.config["weaviate_url"],
+                auth_credentials=weaviate.auth.AuthApiKey(self.config["weaviate_api_key"]),
+                skip_init_checks=True
+            )
+        else:
+            raise ValueError("Weaviate API key is required for online Weaviate.")
+
+    def _insert_many(self, cluster_key: str, data_objects: list, vectors: list,
+                     batch_size: int = 100, concurrency: int = 2, ids: list = None) -> list:
+        """
+        Writes objects with the Weaviate v4 batch API and returns the ids of the
+        ones that were stored; failures are logged. Objects given an existing id
+        replace the stored object.
+        """
+        collection = self._collection(cluster_key)
+        uuids = ids or [None] * len(data_objects)
+        ids = []
+        with collection.batch.fixed_size(batch_size=batch_size, concurrent_requests=concurrency) as batch:
+            for data_object, vector, uuid in zip(data_objects, vectors, uuids):
+                ids.append(str(batch.add_object(properties=data_object, vector=vector, uuid=uuid)))
+        failed = collection.batch.failed_objects
+        if failed:
+            logging.error(f"{len(failed)} of {len(ids)} {cluster_key} objects failed to import, e.g. {failed[0].message}")
+            failed_ids = {str(error.object_.uuid) for error in failed}
+            ids = [id for id in ids if id not in failed_ids]
+        return ids
+
+    def _delete_many(self, cluster_key: str, ids: list) -> int:
+        collection = self._collection(cluster_key)
+        deleted = 0
+        # Chunked to stay well below Weaviate's limit on objects per delete_many.
+        for start in range(0, len(ids), 1000):
+            result = collection.data.delete_many(where=Filter.by_id().contains_any(ids[start:start + 1000]))
+            deleted += result.successful
+        return deleted
+
+    def _clear_collection(self, cluster_key: str) -> None:
+        self._ensure_connected()
+        self.weaviate_client.collections.delete(self.training_data_cluster[cluster_key])
+        self._create_collections_if_not_exist()
+
+    def _ensure_connected(self) -> None:
+        # The base implementation connects and closes the client around every
+        # call, which breaks as soon as lookups overlap. Keep the connection
+        # open instead; it is closed in __exit__.
+        if not self.weaviate_client.is_connected():
+            self.weaviate_client.connect()
+
+    def _collection(self, cluster_key: str):
+        self._ensure_connected()
+        return self.weaviate_client.collections.get(self.training_data_cluster[cluster_key])
+
+    def _query_collection(self, cluster_key: str, vector_input: list, return_properties: list) -> list:
+        collection = self._collection(cluster_key)
+        response = collection.query.near_vector(
+            near_vector=vector_input,
+            limit=self.n_results,
+            return_properties=return_properties,
+            return_metadata=MetadataQuery(distance=True)
+        )
+        return [{**item.properties, "_distance": item.metadata.distance} for item in response.objects]
+
+    def _collection_properties(self, cluster_key: str) -> list:
+        collection = self._collection(cluster_key)
+        return [dict(item.properties) for item in collection.iterator()]
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        super().__exit__(exc_type, exc_val, exc_tb)
+        self.weaviate_client.close()
+        logging.info("\nWeaviate connection closed successfully.")
+
+
+class LocalVanna(VannaPipeline, LocalVectorStore, LangChainAzureChat):
+    """
+    MyVanna on the in-process NumPy vector store instead of Weaviate; runs offline.
+    """
+    def __init__(self, config=None):
+        self.config = config or {}
+        LocalVectorStore.__init__(self, config=config)
+        LangChainAzureChat.__init__(self, config=config)
+        self._init_pipeline()
+
+
+def create_vanna(config: dict) -> VannaPipeline:
+    """
+    Builds the Vanna instance for `config["vector_store"]`: "weaviate" (the
+    default) or "local".
+    """
+    if config.get("vector_store", "weaviate") == "local":
+        return LocalVanna(config=config)
+    return MyVanna(config=config)
@@ -0,0 +1,94 @@
+"""
+Warm-up stage run by app_lifespan before the server reports ready.
+
+Each step pays a first-call cost up front so the first real request does not:
+loading the embedding model, connecting to the vector store, the TLS handshake
+and client setup for Azure OpenAI, loading the tokenizer used for the prompt
+budget, and reading the hot tables into the OS page cache.
+"""
+import logging
+import time
+
+import anyio
+
+WARMUP_STEPS = ("embedding", "vector_store", "tokenizer", "llm", "sqlite")
+
+
+def parse_steps(value: str) -> list:
+    """
+    "all" (or empty) runs every step, "none" (or "0") skips warm-up, otherwise a
+    comma-separated subset of WARMUP_STEPS.
+    """
+    value = (value or "all").strip().lower()
+    if value == "all":
+        return list(WARMUP_STEPS)
+    if value in ("none", "0"):
+        return []
+    steps = [step.strip() for step in value.split(",") if step.strip()]
+    unknown = [step for step in steps if step not in WARMUP_STEPS]
+    if unknown:
+        raise ValueError(f"Unknown warm-up steps {unknown}; expected some of {list(WARMUP_STEPS)}")
+    return steps
+
+
+def _warm_embedding(vn, state: dict) -> None:
+    state["embedding"] = vn.generate_embedding("warm-up")
+
+
+def _warm_vector_store(vn, state: dict) -> None:
+    embedding = state.get("embedding") or vn.generate_embedding("warm-up")
+    vn._query_collection("sql", embedding, ["sql", "natural_language_question"])
+    vn._query_collection("ddl", embedding, ["description"])
+    vn._query_collection("doc", embedding, ["description"])
+
+
+def _warm_tokenizer(vn, state: dict) -> None:
+    vn.prompt_budget.count("warm-up")
+
+
+def _warm_sqlite(vn, state: dict, tables: list = None) -> None:
+    if vn.sqlite_pool is None:
+        return
+    conn = vn.sqlite_pool.connection()
+    if not tables:
+        tables = [row[0] for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'"
+        )]
+    for table in tables:
+        quoted = table.replace('"', '""')
+        # count(*) walks every leaf page of the table's b-tree without
+        # materializing rows, which pulls the table into the page cache.
+        rows = conn.execute(f'SELECT count(*) FROM "{quoted}" NOT INDEXED').fetchone()[0]
+        logging.info(f"  warm-up: read table {table} ({rows} rows)")
+
+
+async def _warm_llm(vn) -> None:
+    await vn.llm.ainvoke([vn.user_message("ping")], max_tokens=1)
+
+
+async def run_warmup(vn, steps: list, tables: list = None) -> dict:
+    """
+    Runs the given warm-up steps in order and returns the seconds each took.
+    A failing step is logged and skipped; the server still starts.
+    """
+    timings = {}
+    state = {}
+    total_start = time.time()
+    for step in steps:
+        start = time.time()
+        try:
+            if step == "llm":
+                await _warm_llm(vn)
+            elif step == "sqlite":
+                await anyio.to_thread.run_sync(_warm_sqlite, vn, state, tables)
+            else:
+                warm = {"embedding": _warm_embedding, "vector_store": _warm_vector_store,
+                        "tokenizer": _warm_tokenizer}[step]
+                await anyio.to_thread.run_sync(warm, vn, state)
+        except Exception as e:
+            logging.warning(f"Warm-up step '{step}' failed: {e}")
+        timings[step] = time.time() - start
+        logging.info(f"🔥 Warm-up {step}: {timings[step]:.3f}s")
+    if steps:
+        logging.info(f"🔥 Warm-up finished in {time.time() - total_start:.3f}s")
+    return timings